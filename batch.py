@@ -0,0 +1,57 @@
+import argparse
+import os
+import signal
+
+from src.batch import BatchRunner, load_profiles
+from src.config import DB_HOST, DB_NAME, DB_PASSWORD, DB_USER, METRICS_FILE, METRICS_FORMAT, PROFILES_FILE, \
+    setup_logging
+from src.database_processings import DBManager
+from src.metrics import metrics
+
+modul_name = os.path.basename(__file__)
+logger = setup_logging(modul_name)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Пакетное обновление профилей поиска вакансий hh.ru без интерактивного ввода. "
+                    "По умолчанию работает постоянно и обновляет каждый профиль с заданным периодом")
+    parser.add_argument("--config", default=PROFILES_FILE, help="файл профилей поиска (см. profiles.example.json)")
+    parser.add_argument("--once", action="store_true", help="обновить все профили один раз и завершить работу")
+    parser.add_argument("--max-parallel", type=int, help="количество заданий, обновляемых одновременно")
+    parser.add_argument("--interval", type=float, help="период обновления всех профилей, мин")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if not all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST]):
+        exit("Не заданы переменные окружения для подключения к БД. Проверьте .env файл и попробуйте снова.")
+    try:
+        profiles, settings = load_profiles(args.config)
+    except (OSError, ValueError) as err:
+        exit(f"Ошибка чтения файла профилей {args.config}: {err}")
+    if not profiles:
+        exit(f"В файле {args.config} нет профилей поиска.")
+    if args.interval:
+        for profile in profiles:
+            profile.interval_minutes = args.interval
+
+    with DBManager(read_data=False) as db_manager:
+        db_manager.create_database()
+        db_manager.create_tables()
+        runner = BatchRunner(profiles, db_manager, args.max_parallel or settings["max_parallel"])
+        if args.once:
+            results = runner.run_once()
+            failed = [result["job"] for result in results if not result["ok"]]
+            print(f"Обновлено заданий: {len(results) - len(failed)} из {len(results)}")
+            if failed:
+                print(f"С ошибкой: {', '.join(failed)}")
+        else:
+            signal.signal(signal.SIGINT, lambda *_: runner.stop())
+            signal.signal(signal.SIGTERM, lambda *_: runner.stop())
+            print(f"Профилей: {len(profiles)}, заданий: {len(runner.jobs)}. Остановка - Ctrl+C")
+            runner.run_forever()
+    logger.info("Метрики сохранены в %s", metrics.export(METRICS_FILE, METRICS_FORMAT))
+    if args.once and failed:
+        exit(1)
@@ -0,0 +1,78 @@
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List
+
+from src.config import DEFAULT_CURRENCY, HH_API_SEARCH_PERIOD_DAYS
+from src.vacancy import Vacancy
+
+# Названия вакансий: слова подобраны так, чтобы по ним работал поиск DBManager
+TITLES = ["Python разработчик", "Senior Python developer", "Java разработчик", "Аналитик данных",
+          "Data Scientist", "Тестировщик", "Менеджер проектов", "DevOps инженер", "Frontend разработчик",
+          "Системный аналитик", "Продуктовый дизайнер", "Инженер по нагрузочному тестированию"]
+AREAS = [("1", "Москва"), ("2", "Санкт-Петербург"), ("78", "Самара"), ("88", "Казань"), ("4", "Новосибирск")]
+# Курсы в формате справочника hh.ru: сколько единиц валюты в одном рубле
+CURRENCY_RATES = {DEFAULT_CURRENCY: 1.0, "USD": 0.0111, "EUR": 0.0102, "KZT": 5.6}
+
+
+def employers(count: int, first_id: int = 100000) -> Dict[str, int]:
+    """Словарь работодателей в формате ID_COMPANY_ON_HHRU: {название: id на hh.ru}"""
+    return {f"Работодатель {i}": first_id + i for i in range(count)}
+
+
+def synthetic_item(index: int, employer_id: int, published: datetime, with_salary: bool,
+                   seed: int = 0) -> Dict[str, Any]:
+    """Элемент items ответа api.hh.ru/vacancies. Содержимое однозначно определяется index и seed,
+    поэтому заглушка API может строить элементы по запросу, не храня их в памяти"""
+    rng = random.Random(seed * 1_000_003 + index)
+    salary = None
+    if with_salary:
+        low = rng.randrange(40, 400) * 1000
+        currency = DEFAULT_CURRENCY if rng.random() < 0.9 else rng.choice(["USD", "EUR", "KZT"])
+        salary = {"from": rng.choice([low, None]), "to": rng.choice([low + rng.randrange(0, 200) * 1000, None]),
+                  "currency": currency, "gross": rng.random() < 0.5}
+        if salary["from"] is None and salary["to"] is None:
+            salary["from"] = low
+    area_id, area_name = rng.choice(AREAS)
+    vacancy_id = str(10_000_000 + index)
+    return {
+        "id": vacancy_id,
+        "premium": False,
+        "name": f"{rng.choice(TITLES)} {index % 97}",
+        "area": {"id": area_id, "name": area_name, "url": f"https://api.hh.ru/areas/{area_id}"},
+        "salary": salary,
+        "type": {"id": "open", "name": "Открытая"},
+        "published_at": published.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "created_at": published.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "archived": False,
+        "url": f"https://api.hh.ru/vacancies/{vacancy_id}",
+        "alternate_url": f"https://hh.ru/vacancy/{vacancy_id}",
+        "employer": {"id": str(employer_id), "name": f"Работодатель {employer_id}", "trusted": True},
+        "snippet": {"requirement": "Опыт работы от 3 лет", "responsibility": "Разработка и сопровождение сервисов"},
+        "schedule": {"id": "remote", "name": "Удаленная работа"},
+    }
+
+
+def synthetic_index(size: int, employer_ids: List[int], seed: int = 0,
+                    period_days: int = HH_API_SEARCH_PERIOD_DAYS) -> List[tuple]:
+    """Компактное описание набора из size вакансий: (index, employer_id, время публикации, есть зарплата),
+    даты публикации равномерно распределены по последним period_days дням. Около 150 байт на вакансию,
+    поэтому набор в 1 млн вакансий помещается в памяти заглушки API"""
+    rng = random.Random(seed)
+    now = datetime.now().astimezone().replace(microsecond=0)
+    period = int(timedelta(days=period_days).total_seconds()) - 60
+    index = []
+    for i in range(size):
+        published = now - timedelta(seconds=rng.randrange(60, period))
+        index.append((i, employer_ids[i % len(employer_ids)], published, rng.random() < 0.7))
+    return index
+
+
+def generate_items(size: int, employer_ids: List[int], seed: int = 0) -> Iterator[Dict[str, Any]]:
+    """Поток из size элементов ответа hh.ru"""
+    for entry in synthetic_index(size, employer_ids, seed):
+        yield synthetic_item(*entry, seed=seed)
+
+
+def generate_vacancies(size: int, employer_ids: List[int], seed: int = 0) -> Iterator[Vacancy]:
+    """Поток из size компактных записей Vacancy, как после разбора страниц клиентом"""
+    return map(Vacancy.from_hh, generate_items(size, employer_ids, seed))
@@ -0,0 +1,133 @@
+import json
+import math
+import random
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.generator import CURRENCY_RATES, synthetic_item
+from src.config import HH_API_DEPTH_LIMIT
+
+
+def _timestamp(value: str) -> float:
+    """Дата из параметров date_from/date_to запроса; дата без часового пояса считается местной"""
+    return datetime.fromisoformat(value).timestamp()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "HHStubServer"
+    protocol_version = "HTTP/1.1"  # keep-alive, как у api.hh.ru
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: Dict, headers: Dict[str, str] | None = None) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+        self.server.count("bytes", len(payload))
+
+    def do_GET(self):
+        server = self.server
+        server.count("requests")
+        if server.latency:
+            time.sleep(server.latency)
+        url = urlparse(self.path)
+        if url.path == "/dictionaries":
+            self._send(200, {"currency": [{"code": code, "rate": rate} for code, rate in CURRENCY_RATES.items()]})
+            return
+        if url.path != "/vacancies":
+            self._send(404, {"errors": [{"type": "not_found"}]})
+            return
+        if server.error_rate and server.random() < server.error_rate:
+            server.count("throttled")
+            self._send(429, {"errors": [{"type": "too_many_requests"}]}, {"Retry-After": str(server.retry_after)})
+            return
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        page = int(params.get("page", 0))
+        per_page = int(params.get("per_page", 20))
+        if (page + 1) * per_page > HH_API_DEPTH_LIMIT:
+            self._send(400, {"errors": [{"type": "bad_argument", "value": "page"}]})
+            return
+        entries = server.select(params)
+        found = len(entries)
+        # Выдача отсортирована по дате публикации от новых к старым
+        window = entries[max(0, found - (page + 1) * per_page):max(0, found - page * per_page)][::-1]
+        self._send(200, {
+            "items": [synthetic_item(*entry, seed=server.seed) for entry in window],
+            "found": found,
+            "pages": math.ceil(min(found, HH_API_DEPTH_LIMIT) / per_page),
+            "page": page,
+            "per_page": per_page,
+        })
+
+
+class HHStubServer(ThreadingHTTPServer):
+    """Локальная заглушка api.hh.ru для измерений без сети: /vacancies с постраничной выдачей, фильтрами
+    employer_id, only_with_salary, date_from/date_to и ограничением глубины выдачи, а также справочник
+    /dictionaries с курсами валют. latency - задержка каждого ответа, сек; error_rate - доля ответов 429
+    с заголовком Retry-After: retry_after. Запускается в фоновом потоке на свободном порту в блоке with"""
+
+    daemon_threads = True
+
+    def __init__(self, index: List[tuple], latency: float = 0.0, error_rate: float = 0.0,
+                 retry_after: float = 0.05, seed: int = 0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.stats = defaultdict(int)
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        # Для каждого работодателя - вакансии по возрастанию даты публикации, отдельно все и только с зарплатой
+        self._entries = defaultdict(lambda: ([], []))
+        self._times = defaultdict(lambda: ([], []))
+        for entry in sorted(index, key=lambda e: e[2]):
+            employer_id, published, with_salary = entry[1], entry[2].timestamp(), entry[3]
+            for only_salary in ((False, True) if with_salary else (False,)):
+                self._entries[employer_id][only_salary].append(entry)
+                self._times[employer_id][only_salary].append(published)
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.stats[name] += value
+
+    def random(self) -> float:
+        with self._lock:
+            return self._random.random()
+
+    def select(self, params: Dict[str, str]) -> List[tuple]:
+        """Вакансии работодателя, подходящие под фильтры запроса, по возрастанию даты публикации"""
+        employer_id = int(params.get("employer_id", 0))
+        only_salary = params.get("only_with_salary", "0") in ("1", "true", "True")
+        entries = self._entries[employer_id][only_salary] if employer_id in self._entries else []
+        times = self._times[employer_id][only_salary] if employer_id in self._times else []
+        start = bisect_left(times, _timestamp(params["date_from"])) if params.get("date_from") else 0
+        end = bisect_right(times, _timestamp(params["date_to"])) if params.get("date_to") else len(times)
+        return entries[start:end]
+
+    def __enter__(self) -> "HHStubServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="hh-stub", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,205 @@
+import argparse
+import functools
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+
+from benchmarks.generator import employers, generate_vacancies, synthetic_index
+from benchmarks.hh_stub import HHStubServer
+from src import database_processings, transform
+from src.api_client import HHAPIClient
+from src.config import DB_HOST, DB_NAME, DB_PASSWORD, DB_USER
+from src.database_processings import DBManager
+from src.metrics import metrics
+from src.rate_limiter import TokenBucket
+from src.response_cache import ResponseCache
+from src.utils import JsonCacheWriter, iter_json_vacancies, read_json_metadata
+from src.vacancy import Vacancy
+
+SCENARIOS = ["fetch", "cache", "db_load", "db_queries"]
+QUERIES = {
+    "get_companies_and_vacancies_count": lambda db: db.get_companies_and_vacancies_count(),
+    "get_all_vacancies": lambda db: db.get_all_vacancies(),
+    "get_avg_salary": lambda db: db.get_avg_salary(),
+    "get_salary_stats": lambda db: db.get_salary_stats(),
+    "get_vacancies_with_higher_salary": lambda db: db.get_vacancies_with_higher_salary(),
+    "get_vacancies_with_keyword": lambda db: db.get_vacancies_with_keyword("python"),
+    "search_vacancies": lambda db: db.search_vacancies("разработчик", limit=50),
+    "search_vacancies_area": lambda db: db.search_vacancies("разработчик", limit=50, area=113),
+    "get_salary_history": lambda db: db.get_salary_history(),
+}
+
+
+def timed(func: Callable, *args, **kwargs) -> tuple:
+    """Результат вызова и время выполнения в секундах"""
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """Сводка по времени выполнения, мс"""
+    ordered = sorted(samples)
+    return {
+        "runs": len(ordered),
+        "mean_ms": round(statistics.fmean(ordered) * 1000, 3),
+        "p50_ms": round(ordered[len(ordered) // 2] * 1000, 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+def per_second(count: float, seconds: float) -> float:
+    return round(count / seconds, 1) if seconds else 0.0
+
+
+def bench_fetch(size: int, args, work_dir: Path) -> Dict[str, Any]:
+    """Сбор всех страниц всех работодателей клиентом HHAPIClient с заглушки API"""
+    company = employers(args.employers)
+    index = synthetic_index(size, list(company.values()), args.seed)
+    with HHStubServer(index, args.latency, args.error_rate, args.retry_after, args.seed) as stub:
+        client = HHAPIClient(company, pages=0, salary=0, file_path=work_dir, file_name="fetch",
+                             max_workers=args.workers, rate_limiter=TokenBucket(args.rate, args.workers),
+                             response_cache=ResponseCache(work_dir / "responses"), use_cache=False, autorun=False)
+        client.BASE_URL = f"{stub.url}/vacancies"
+        items, seconds = timed(lambda: sum(len(page) for page in client.iter_pages(company, 0, 0)))
+        stats = dict(stub.stats)
+    return {"items": items, "seconds": round(seconds, 3), "items_per_s": per_second(items, seconds),
+            "requests": stats.get("requests", 0), "requests_per_s": per_second(stats.get("requests", 0), seconds),
+            "throttled": stats.get("throttled", 0), "mb_received": round(stats.get("bytes", 0) / 2 ** 20, 2)}
+
+
+def bench_cache(size: int, args, work_dir: Path) -> Dict[str, Any]:
+    """Запись файла данных JsonCacheWriter и чтение его обратно в записи Vacancy"""
+    company = employers(args.employers)
+    vacancies = list(generate_vacancies(size, list(company.values()), args.seed))
+    metadata = {"_metadata": {"company_id_dict": company, "area": 113, "salary": 0}}
+
+    def write():
+        with JsonCacheWriter(work_dir, "cache", metadata) as writer:
+            writer.write_many(vacancies)
+
+    _, write_seconds = timed(write)
+    meta, meta_seconds = timed(read_json_metadata, work_dir, "cache")
+    count, read_seconds = timed(lambda: sum(1 for _ in map(Vacancy.from_dict, iter_json_vacancies(work_dir, "cache"))))
+    size_mb = meta["body_size"] / 2 ** 20
+    return {"items": count, "mb": round(size_mb, 2),
+            "write_seconds": round(write_seconds, 3), "write_items_per_s": per_second(size, write_seconds),
+            "write_mb_per_s": per_second(size_mb, write_seconds),
+            "read_seconds": round(read_seconds, 3), "read_items_per_s": per_second(count, read_seconds),
+            "read_mb_per_s": per_second(size_mb, read_seconds), "metadata_ms": round(meta_seconds * 1000, 3)}
+
+
+def _loaded_db(size: int, args, work_dir: Path) -> tuple:
+    """DBManager на отдельной БД с загруженным синтетическим набором и время загрузки"""
+    company = employers(args.employers)
+    metadata = {"_metadata": {"company_id_dict": company, "area": 113, "salary": 0}}
+    with JsonCacheWriter(work_dir, "db", metadata) as writer:
+        writer.write_many(generate_vacancies(size, list(company.values()), args.seed))
+    db = DBManager(work_dir, "db", cache_size=0)
+    db.create_database(args.db_name)
+    db.create_tables(rebuild=True)
+    stats, seconds = timed(db.save_to_database)
+    return db, stats, seconds
+
+
+def bench_db_load(size: int, args, work_dir: Path) -> Dict[str, Any]:
+    """Загрузка в пустую БД, повторная загрузка без изменений и проверка отпечатка набора данных"""
+    db, stats, seconds = _loaded_db(size, args, work_dir)
+    with db:
+        reload_stats, reload_seconds = timed(db.save_to_database)
+        loaded, lookup_seconds = timed(db.is_loaded)
+    return {"items": size, "loaded": stats["loaded"], "inserted": stats["inserted"], "seconds": round(seconds, 3),
+            "rows_per_s": per_second(stats["loaded"], seconds), "reload_seconds": round(reload_seconds, 3),
+            "reload_rows_per_s": per_second(reload_stats["loaded"], reload_seconds),
+            "reload_updated": reload_stats["updated"], "fingerprint_match": loaded,
+            "fingerprint_lookup_ms": round(lookup_seconds * 1000, 3)}
+
+
+def bench_db_queries(size: int, args, work_dir: Path) -> Dict[str, Any]:
+    """Время выполнения запросов DBManager.get_* без кэша результатов"""
+    db, _, _ = _loaded_db(size, args, work_dir)
+    result = {"items": size}
+    with db:
+        for name, query in QUERIES.items():
+            query(db)  # прогрев
+            result[name] = latency_stats([timed(query, db)[1] for _ in range(args.repeat)])
+    return result
+
+
+BENCHMARKS = {"fetch": bench_fetch, "cache": bench_cache, "db_load": bench_db_load, "db_queries": bench_db_queries}
+
+
+def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Замеры производительности сбора, файла данных и БД на синтетических данных без доступа "
+                    "к hh.ru. Результат - JSON для сравнения запусков. Сценарии db_* используют БД из .env "
+                    "(создаётся отдельная БД --db-name)")
+    parser.add_argument("--sizes", default="1000,10000", help="размеры наборов вакансий через запятую, до 1000000")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="сценарии через запятую: "
+                        + ", ".join(SCENARIOS))
+    parser.add_argument("--employers", type=int, default=10, help="количество работодателей в наборе")
+    parser.add_argument("--seed", type=int, default=0, help="зерно генератора данных")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа заглушки API, сек")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля ответов 429 заглушки API")
+    parser.add_argument("--retry-after", type=float, default=0.05, help="Retry-After в ответах 429, сек")
+    parser.add_argument("--workers", type=int, default=4, help="потоки HHAPIClient")
+    parser.add_argument("--rate", type=float, default=1000.0, help="лимит частоты запросов клиента, запр/с")
+    parser.add_argument("--repeat", type=int, default=20, help="повторов каждого запроса в db_queries")
+    parser.add_argument("--db-name", default="hh_benchmark", help="БД для сценариев db_*")
+    parser.add_argument("--output", help="файл результата, по умолчанию - стандартный вывод")
+    args = parser.parse_args(argv)
+    args.sizes = [int(size) for size in args.sizes.split(",")]
+    args.scenarios = [name.strip() for name in args.scenarios.split(",")]
+    unknown = set(args.scenarios) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+    return args
+
+
+def main(argv: List[str] | None = None) -> Dict[str, Any]:
+    args = parse_args(argv)
+    report = {
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "params": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": [],
+    }
+    db_configured = all([DB_NAME, DB_USER, DB_PASSWORD, DB_HOST])
+    with tempfile.TemporaryDirectory(prefix="hh_bench_") as tmp:
+        # Курсы валют берутся из заглушки и хранятся во временном каталоге, а не в data/
+        with HHStubServer([]) as rates_stub:
+            transform.CURRENCY_RATES_URL = f"{rates_stub.url}/dictionaries"
+            database_processings.load_currency_rates = functools.partial(
+                transform.load_currency_rates, Path(tmp) / "currency_rates.json")
+            database_processings.load_currency_rates()
+        for name in args.scenarios:
+            for size in args.sizes:
+                entry = {"scenario": name, "size": size}
+                if name.startswith("db_") and not db_configured:
+                    entry["skipped"] = "не заданы переменные окружения для подключения к БД"
+                else:
+                    work_dir = Path(tempfile.mkdtemp(dir=tmp))
+                    metrics.reset()
+                    entry.update(BENCHMARKS[name](size, args, work_dir))
+                    entry["metrics"] = metrics.snapshot()
+                report["results"].append(entry)
+                print(f"{name} {size}: готово", file=sys.stderr)
+    text = json.dumps(report, ensure_ascii=False, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        print(text)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,28 @@
 import os
 
+import requests
+
 from src.config import (DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, DATA_DIR, HH_API_AREA, PAGES, ID_COMPANY_ON_HHRU,
-                        DEFAULT_JSON_FILE, CACHE_EXPIRE_HOURS, setup_logging)
+                        DEFAULT_JSON_FILE, CACHE_EXPIRE_HOURS, INCREMENTAL_FETCH, PIPELINE_MODE, METRICS_FILE,
+                        METRICS_FORMAT, setup_logging)
 from src.database_processings import DBManager
-from src.utils import check_exist_json_data
-from src.api_client import HHAPIClient
+from src.metrics import metrics
+from src.pipeline import run_pipeline
+from src.utils import cache_matches_params, check_exist_json_data
+from src.api_client import HHAPIClient, request_error_message
 
 modul_name = os.path.basename(__file__)
 logger = setup_logging(modul_name)
 
 
 def print_vacancies(vacancies):
-    """Вывод результатов в консоль"""
+    """Вывод результатов в консоль по мере поступления, возвращает количество выведенных вакансий"""
+    count = 0
     for v in vacancies:
+        count += 1
         print(f"Компания: {v['company']}\nДолжность: {v['title']}\nЗарплата: {v['salary_from']}-{v['salary_to']} "
               f"{v['currency']}\nСсылка: {v['url']}\n")
+    return count
 
 
 if __name__ == "__main__":
@@ -46,39 +54,79 @@ if __name__ == "__main__":
                         f"Enter - использовать его, любой символ + Enter - обновить файл данных: ") if check_data \
         else False
 
-    if choice_user or not check_data:
-        HHAPIClient(company_id_dict=query_params[0],
-                    area=query_params[1],
-                    pages=query_params[2],
-                    salary=query_params[3],
-                    file_path=query_params[4],
-                    file_name=query_params[5])
-        logger.info("Обновляем данные")
-
-    db_manager = DBManager(file_path=DATA_DIR, file_name=DEFAULT_JSON_FILE)
-
-    db_manager.create_database()
-
-    db_manager.create_tables()
-
-    db_manager.save_to_database()
+    need_fetch = choice_user or not check_data
+    full_crawl = choice_user or not INCREMENTAL_FETCH or not cache_matches_params(
+        query_params[4], query_params[5], query_params[1], query_params[3])
+
+    if need_fetch and full_crawl and PIPELINE_MODE:
+        # Полный сбор: страницы загружаются в БД по мере получения, файл данных пишется попутно
+        logger.info("Обновляем данные конвейером")
+        db_manager = DBManager(file_path=DATA_DIR, file_name=DEFAULT_JSON_FILE, read_data=False)
+
+        db_manager.create_database()
+
+        db_manager.create_tables()
+
+        client = HHAPIClient(company_id_dict=query_params[0],
+                             area=query_params[1],
+                             pages=query_params[2],
+                             salary=query_params[3],
+                             file_path=query_params[4],
+                             file_name=query_params[5],
+                             use_cache=not choice_user,
+                             autorun=False)
+        try:
+            run_pipeline(client, db_manager)
+        except requests.exceptions.RequestException as err:
+            logger.warning("Ошибка запроса: %s. Exit.", err)
+            exit(request_error_message(err))
+    else:
+        if need_fetch:
+            try:
+                HHAPIClient(company_id_dict=query_params[0],
+                            area=query_params[1],
+                            pages=query_params[2],
+                            salary=query_params[3],
+                            file_path=query_params[4],
+                            file_name=query_params[5],
+                            incremental=INCREMENTAL_FETCH and not choice_user,
+                            use_cache=not choice_user)
+            except requests.exceptions.RequestException as err:
+                exit(request_error_message(err))
+            except ValueError as err:
+                exit(str(err))
+            logger.info("Обновляем данные")
+
+        db_manager = DBManager(file_path=DATA_DIR, file_name=DEFAULT_JSON_FILE)
+
+        db_manager.create_database()
+
+        if db_manager.is_loaded():
+            logger.info("Данные в БД совпадают с файлом данных, загрузка пропущена")
+        else:
+            db_manager.create_tables()
+
+            db_manager.save_to_database()
 
     print("\nКомпании и количество вакансий:")
-    vacancies_count = db_manager.get_companies_and_vacancies_count()
+    vacancies_count = db_manager.get_companies_and_vacancies_count(area=query_params[1])
     for item in vacancies_count:
         print(f"{item['name']}: {item['vacancies_count']} вакансий")
 
     print("\nСредняя зарплата:")
-    print(db_manager.get_avg_salary())
+    print(db_manager.get_avg_salary(area=query_params[1]))
 
-    vacancies_higher = db_manager.get_vacancies_with_higher_salary()
+    vacancies_higher = db_manager.get_vacancies_with_higher_salary(area=query_params[1])
     print(f"\nВакансий с зарплатой выше средней {len(vacancies_higher)}:\n")
     print_vacancies(vacancies_higher)
 
-    vacancies_by_keyword = db_manager.get_vacancies_with_keyword(
-        search_word) if search_word else db_manager.get_all_vacancies()
-    if not vacancies_by_keyword:
+    vacancies_by_keyword = db_manager.iter_vacancies_with_keyword(
+        search_word, area=query_params[1]) if search_word else db_manager.iter_all_vacancies(area=query_params[1])
+    print(f"\nВакансии по ключевому слову \"{search_word.upper()}\":\n")
+    found_count = print_vacancies(vacancies_by_keyword)
+    if not found_count:
         print("Соответствующие Вашему запросу вакансии не обнаружены.")
     else:
-        print(f"\nВакансий по ключевому слову \"{search_word.upper()}\" {len(vacancies_by_keyword)}:\n")
-        print_vacancies(vacancies_by_keyword)
+        print(f"Вакансий по ключевому слову \"{search_word.upper()}\": {found_count}")
+    logger.info("Кэш запросов: %s", db_manager.cache_stats())
+    logger.info("Метрики сохранены в %s", metrics.export(METRICS_FILE, METRICS_FORMAT))
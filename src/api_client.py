@@ -1,14 +1,26 @@
 # import json
 import os
+import random
 import time
 import requests
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
 from pathlib import Path
 from abc import ABC, abstractmethod
-from typing import Any, List, Dict
+from typing import Any, List, Dict, Iterator, Optional
+from requests.adapters import HTTPAdapter
 
 from src.config import DATA_DIR, HH_API_AREA, HH_API_HEADERS, HH_API_URL, PAGES, PER_PAGE, ID_COMPANY_ON_HHRU, \
-    ONLY_SALARY, DEFAULT_CURRENCY, DEFAULT_JSON_FILE, setup_logging
-from src.utils import overwriting_json_data
+    ONLY_SALARY, DEFAULT_CURRENCY, DEFAULT_JSON_FILE, HH_API_MAX_WORKERS, HH_API_MAX_RETRIES, HH_API_BACKOFF_FACTOR, \
+    HH_API_BACKOFF_MAX, HH_API_TIMEOUT, HH_API_DEPTH_LIMIT, HH_API_SEARCH_PERIOD_DAYS, HH_API_MIN_SLICE_MINUTES, \
+    RESPONSE_CACHE_MAX_MB, KEEP_RAW_PAYLOAD, INCREMENTAL_FULL_SWEEP_HOURS, setup_logging
+from src.metrics import metrics
+from src.rate_limiter import TokenBucket
+from src.response_cache import ResponseCache
+from src.vacancy import Vacancy
+from src.utils import as_aware, cache_matches_params, is_expired, iter_json_vacancies, overwriting_json_data, \
+    parse_hh_datetime, read_json_metadata
 
 modul_name = os.path.basename(__file__)
 logger = setup_logging(modul_name)
@@ -20,10 +32,45 @@ class AbstractAPIClient(ABC):
         pass
 
 
+RETRY_STATUSES = {429, 500, 502, 503, 504}  # Коды ответов, при которых запрос повторяется
+
+
+def create_session(pool_size: int = HH_API_MAX_WORKERS) -> requests.Session:
+    """Создаёт HTTP-сессию с пулом keep-alive соединений, рассчитанным на pool_size параллельных потоков"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update(HH_API_HEADERS)
+    return session
+
+
+def request_error_message(err: Exception) -> str:
+    """Сообщение о прекращении работы программы из-за ошибки запроса к hh.ru"""
+    return (f"Ошибка запроса: {err}. Работа программы прекращена:\nНе удалось получить данные с сайта hh.ru, "
+            f"проверьте соединение с интернетом и попробуйте снова.")
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбор заголовка Retry-After: число секунд или HTTP-дата. None - если заголовок отсутствует или некорректен"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
 class HHAPIClient(AbstractAPIClient):
     """Класс создаёт файл с полученными по запросу данными о вакансиях. В сценарий по умолчанию заложено:
     запрос первой страницы с 100 вакансиями на страницу. Все полученные 'сырые' данные
-    записываются в файл. В случае возникновения ошибок в получении данных с сайта выбрасывается исключение"""
+    записываются в файл. В случае возникновения ошибок в получении данных с сайта выбрасывается исключение.
+    Страницы запрашиваются параллельно (max_workers потоков) через одну keep-alive сессию, частота запросов
+    ограничивается общей корзиной токенов rate_limiter"""
 
     logger.info("Старт api-клиента")
     BASE_URL = HH_API_URL
@@ -35,7 +82,15 @@ class HHAPIClient(AbstractAPIClient):
             pages: int = PAGES,
             salary: Any = ONLY_SALARY,
             file_path: Path = DATA_DIR,
-            file_name: str = DEFAULT_JSON_FILE
+            file_name: str = DEFAULT_JSON_FILE,
+            max_workers: int = HH_API_MAX_WORKERS,
+            rate_limiter: TokenBucket | None = None,
+            session: requests.Session | None = None,
+            incremental: bool = False,
+            use_cache: bool = True,
+            response_cache: ResponseCache | None = None,
+            autorun: bool = True,
+            keep_raw: bool = KEEP_RAW_PAYLOAD
     ):
         self.company = company_id_dict
         self.area = area
@@ -45,70 +100,308 @@ class HHAPIClient(AbstractAPIClient):
         self.salary = salary if salary else ONLY_SALARY
         self.file_path = Path(file_path)
         self.file_name = file_name
-        logger.info(f"Инициализатор. Зона охвата вакансий - {self.area}, статус 'Только с зарплатой' - {self.salary}")
-        self.all_info = self.get_vacancies(self.company, self.area, self.pages, self.salary)
+        self.max_workers = max(1, max_workers)
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.session = session or create_session(self.max_workers)
+        # Кэш ответов пополняется всегда, а читается только при use_cache=True (False - принудительное обновление)
+        self.response_cache = response_cache or (ResponseCache() if RESPONSE_CACHE_MAX_MB > 0 else None)
+        self.use_cache = use_cache
+        self.keep_raw = keep_raw
+        logger.info("Инициализатор. Зона охвата вакансий - %s, статус 'Только с зарплатой' - %s",
+                    self.area, self.salary)
+        self.all_info = []
+        if not autorun:  # сбор будет запущен позже, например потоково через iter_pages
+            return
+        if incremental:
+            self.all_info = self.update_vacancies(self.company, self.area, self.pages, self.salary)
+        else:
+            self.all_info = self.get_vacancies(self.company, self.area, self.pages, self.salary)
 
     def __repr__(self):
         return (f"company_id_dict: {self.company},\narea: {self.area},\npages: {self.pages},"
                 f"\nper pages: {self.per_page},\nheaders: {self.headers},\nonly salary: {self.salary}."
-                f"\nfile name: {self.file_name}.json")
+                f"\nworkers: {self.max_workers},\nrate limiter: {self.rate_limiter}."
+                f"\nresponse cache: {self.response_cache}."
+                f"\nfile name: {self.file_name}.ndjson")
 
     def __iter__(self):
         return iter(self.all_info)
 
+    def _request(self, params: Dict) -> Dict:
+        """GET-запрос к API с ограничением частоты и повторами при ответах 429/5xx и сетевых ошибках.
+        Задержка повтора берётся из Retry-After, иначе - экспоненциальный откат со случайным разбросом"""
+        for attempt in range(HH_API_MAX_RETRIES + 1):
+            metrics.observe("rate_limiter_wait_seconds", self.rate_limiter.acquire())
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.get(self.BASE_URL, params=params, timeout=HH_API_TIMEOUT)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as err:
+                metrics.inc("http_requests_total", status="error")
+                if attempt == HH_API_MAX_RETRIES:
+                    raise
+                logger.warning("Сетевая ошибка %s, повтор %s", err, attempt + 1)
+            else:
+                metrics.observe("http_request_seconds", time.perf_counter() - started)
+                metrics.inc("http_requests_total", status=response.status_code)
+                metrics.inc("http_response_bytes_total", len(response.content))
+                if response.status_code not in RETRY_STATUSES or attempt == HH_API_MAX_RETRIES:
+                    response.raise_for_status()
+                    return response.json()
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                logger.warning("Ответ %s, повтор %s, Retry-After: %s", response.status_code, attempt + 1, retry_after)
+            metrics.inc("http_retries_total")
+            if retry_after is None:
+                retry_after = min(HH_API_BACKOFF_MAX, HH_API_BACKOFF_FACTOR * 2 ** attempt)
+                retry_after *= random.uniform(0.5, 1.0)
+            else:
+                retry_after = min(HH_API_BACKOFF_MAX, retry_after)
+                self.rate_limiter.block_for(retry_after)  # сервер просит подождать всех, а не только этот поток
+            time.sleep(retry_after)
+        raise requests.exceptions.RetryError("Превышено количество повторов запроса")
+
+    def _query(self, key: str, params: Dict, page: int) -> Dict:
+        """Получение одной страницы выдачи по заданным параметрам. Возвращаются поля found и pages ответа,
+        а элементы items сразу проецируются в компактные записи Vacancy"""
+        params = {**params, "page": page}
+        # Запросы с date_from (обновление по дате, окна по дате) зависят от текущего времени и не кэшируются
+        cacheable = self.response_cache is not None and "date_from" not in params
+        if cacheable and self.use_cache:
+            response = self.response_cache.get(params)
+            if response is not None:
+                logger.debug("Страница %s %s взята из кэша", page, key)
+                response["items"] = [Vacancy.from_dict(item) for item in response.get("items", [])]
+                metrics.inc("api_pages_total", source="cache")
+                metrics.inc("api_items_total", len(response["items"]))
+                return response
+        logger.debug("Запрос %s стр.%s %s", key, page, params.get("date_from", ""))
+        raw = self._request(params)
+        logger.debug("Страница %s %s получена", page, key)
+        response = {
+            "found": raw.get("found", 0),
+            "pages": raw.get("pages", 0),
+            "items": [Vacancy.from_hh(item, self.keep_raw) for item in raw.get("items", [])]
+        }
+        metrics.inc("api_pages_total", source="network")
+        metrics.inc("api_items_total", len(response["items"]))
+        if cacheable:
+            self.response_cache.set(params, {**response, "items": [item.to_dict() for item in response["items"]]})
+        return response
+
+    def _max_pages(self, response: Dict) -> int:
+        """Количество страниц, которые реально можно получить по запросу с учётом глубины выдачи hh.ru"""
+        return min(response.get("pages", 0), HH_API_DEPTH_LIMIT // self.per_page)
+
+    def _split_by_date(self, key: str, params: Dict) -> List[tuple]:
+        """Разбивает запрос на окна по дате публикации, пока каждое окно не уложится в глубину выдачи.
+        Возвращает список (параметры окна, ответ на первую страницу окна). Границы окон передаются
+        с часовым поясом, иначе hh.ru трактует их как московское время"""
+        date_to = datetime.now().astimezone().replace(microsecond=0)
+        date_from = parse_hh_datetime(params.get("date_from"))
+        date_from = as_aware(date_from) if date_from else date_to - timedelta(days=HH_API_SEARCH_PERIOD_DAYS)
+        windows = [(date_from, date_to)]
+        min_width = timedelta(minutes=HH_API_MIN_SLICE_MINUTES)
+        slices = []
+        while windows:
+            start, end = windows.pop()
+            window_params = {**params, "date_from": start.isoformat(), "date_to": end.isoformat()}
+            first = self._query(key, window_params, 0)
+            if first.get("found", 0) > HH_API_DEPTH_LIMIT and end - start > min_width:
+                middle = (start + (end - start) / 2).replace(microsecond=0)
+                windows.extend([(middle, end), (start, middle)])
+                continue
+            if first.get("found", 0) > HH_API_DEPTH_LIMIT:
+                logger.warning("%s: в окне %s - %s вакансий %s, часть будет потеряна",
+                               key, start, end, first.get("found"))
+            slices.append((window_params, first))
+        logger.info("%s: запрос разбит на %s окон по дате публикации", key, len(slices))
+        return slices
+
+    def _plan_slices(self, key: str, employer_id: Any, pages: int, with_salary: int,
+                     date_from: str | None = None) -> List[tuple]:
+        """Запрашивает первую страницу работодателя и по полям found/pages определяет, какие страницы существуют.
+        Если вакансий больше глубины выдачи и нужны все страницы - запрос разбивается на окна по дате публикации.
+        date_from - запрашивать только вакансии, опубликованные начиная с этой даты.
+        Возвращает список (ключ, параметры среза, ответ на первую страницу, количество страниц к загрузке)"""
+        params = {
+            "employer_id": employer_id,
+            "area": self.area,
+            "per_page": self.per_page,
+            "currency": DEFAULT_CURRENCY,
+            "only_with_salary": with_salary
+        }
+        if date_from:
+            params["date_from"] = date_from
+        first = self._query(key, params, 0)
+        found = first.get("found", 0)
+        logger.info("%s: найдено вакансий %s, страниц %s", key, found, first.get("pages", 0))
+        wanted = pages * self.per_page if pages else found
+        if found > HH_API_DEPTH_LIMIT and wanted > HH_API_DEPTH_LIMIT:
+            slices = self._split_by_date(key, params)
+            return [(key, slice_params, response, self._max_pages(response)) for slice_params, response in slices]
+        n_pages = self._max_pages(first)
+        return [(key, params, first, min(n_pages, pages) if pages else n_pages)]
+
+    def iter_pages(self, company_id_dict: Dict, pages: int, with_salary: int,
+                   since: Dict[str, str] | None = None) -> Iterator[List[Vacancy]]:
+        """Параллельный сбор вакансий работодателей с выдачей страниц по мере их получения (порядок не
+        гарантируется). Повторы вакансий (срезы по датам пересекаются на границах) отбрасываются по id.
+        since - {hh_id работодателя: дата}, для этих работодателей запрашиваются только вакансии,
+        опубликованные начиная с даты"""
+        since = since or {}
+        logger.info("Старт. Работодателей = %s, потоков = %s, лимит = %s запр/с", len(company_id_dict),
+                    self.max_workers, self.rate_limiter.rate)
+        started = time.perf_counter()
+        seen = set()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            # Первые страницы (и при необходимости разбиение по датам) по всем работодателям; как только план
+            # работодателя готов, в очередь ставятся только реально существующие оставшиеся страницы его срезов
+            pending = {executor.submit(self._plan_slices, key, value, pages, with_salary, since.get(str(value))): None
+                       for key, value in company_id_dict.items()}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    task = pending.pop(future)
+                    if task is None:
+                        items = []
+                        for key, params, first, n_pages in future.result():
+                            items.extend(first.get("items", []))
+                            pending.update({executor.submit(self._query, key, params, p): (key, p)
+                                            for p in range(1, n_pages)})
+                    else:
+                        items = future.result().get("items", [])
+                    unique = [vacancy for vacancy in items if vacancy.id not in seen]
+                    seen.update(vacancy.id for vacancy in unique)
+                    if unique:
+                        yield unique
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            metrics.observe("phase_seconds", time.perf_counter() - started, phase="fetch")
+        logger.info("Общий сбор данных завершён вакансий собрано %s, кэш ответов: %s", len(seen),
+                    self.response_cache.stats() if self.response_cache else "отключён")
+
+    def _collect(self, company_id_dict: Dict, pages: int, with_salary: int,
+                 since: Dict[str, str] | None = None) -> List[Vacancy]:
+        """Сбор вакансий работодателей в список, см. iter_pages"""
+        return [vacancy for items in self.iter_pages(company_id_dict, pages, with_salary, since) for vacancy in items]
+
+    @staticmethod
+    def employers_state(vacancies: List[Vacancy], employer_ids: List[str],
+                         previous: Dict[str, Dict] | None = None,
+                         since: Dict[str, str] | None = None) -> Dict[str, Dict]:
+        """Состояние работодателей для кэша: время последнего запроса (fetched_at), время последнего полного
+        запроса (swept_at) и самая поздняя дата публикации среди полученных вакансий (published_at) - с неё
+        начнётся следующее обновление. since - работодатели, запрошенные только по дате публикации:
+        для них сохраняется прежнее время полного запроса"""
+        now = datetime.now().replace(microsecond=0).isoformat()
+        state = {}
+        for employer_id in employer_ids:
+            old = (previous or {}).get(employer_id, {})
+            swept_at = old.get("swept_at") if employer_id in (since or {}) else now
+            state[employer_id] = {"fetched_at": now, "swept_at": swept_at, "published_at": old.get("published_at")}
+        for vacancy in vacancies:
+            HHAPIClient.track_published(state, vacancy)
+        return state
+
+    @staticmethod
+    def track_published(state: Dict[str, Dict], vacancy: Vacancy) -> None:
+        """Сдвиг даты последней публикации работодателя в state, если вакансия опубликована позже.
+        Дата хранится с часовым поясом hh.ru, чтобы следующий запрос date_from не зависел от пояса компьютера"""
+        employer_id = vacancy.employer_id
+        published = parse_hh_datetime(vacancy.published_at)
+        if employer_id not in state or published is None:
+            return
+        current = parse_hh_datetime(state[employer_id]["published_at"])
+        if current is None or as_aware(published) > as_aware(current):
+            state[employer_id]["published_at"] = as_aware(published).isoformat()
+
+    @staticmethod
+    def cache_metadata(company_id_dict: Dict, area: int, salary: Any, state: Dict[str, Dict]) -> Dict:
+        """Метаданные запроса для файла данных"""
+        return {
+            "_metadata": {
+                "company_id_dict": company_id_dict,
+                "area": area,
+                "salary": salary
+            },
+            "employers_state": state
+        }
+
+    def _save(self, vacancies, company_id_dict: Dict, area: int, salary: Any, state: Dict[str, Dict]) -> None:
+        """Запись вакансий и метаданных запроса в файл данных"""
+        overwriting_json_data(vacancies, self.file_path, self.file_name,
+                              self.cache_metadata(company_id_dict, area, salary, state))
+
     def get_vacancies(self, company_id_dict: Dict, area: int, pages: int, salary: Any) -> list | None:
         """Получение списка вакансий по списку компаний-работодателей
         company_id_dict - словарь "Название_работодателя": "код_работодателя_на_hh.ru"(см. config.py);
         area - город расположения вакансий, по умолчанию 113 - Россия, можно задать города;
-        pages - количество страниц вакансий по каждому работодателю, по умолчанию 1 страница;
+        pages - максимум страниц вакансий по каждому работодателю, по умолчанию 1 страница, 0 - все страницы
+        (при выдаче больше глубины hh.ru запрос по работодателю разбивается на окна по дате публикации);
         param salary: любой символ — только с зарплатой, ""(None) — все вакансии.
+        Ошибки запроса к hh.ru (requests.exceptions.RequestException) и пустой словарь компаний (ValueError)
+        передаются вызывающему коду.
         """
         with_salary = 1 if salary else 0
         if not company_id_dict:
-            logger.warning("Пустой словарь компаний!. Exit")
-            exit("Отсутствуют данные для запроса по компаниям. Работа программы завершена.\n"
-                 "Проверьте ID_COMPANY_ON_HHRU в config.py или укажите другой и попробуйте снова.")
-        remaining_requests = len(company_id_dict) * pages  # Общее число запросов
-        delay = 0.5 if remaining_requests >= 20 else 0.1  # уважаем чужой API
-        logger.info(f"Старт. Общее количество запросов = {remaining_requests}, delay = {delay}")
-        all_vacancies = []
+            logger.warning("Пустой словарь компаний!")
+            raise ValueError("Отсутствуют данные для запроса по компаниям. Работа программы завершена.\n"
+                             "Проверьте ID_COMPANY_ON_HHRU в config.py или укажите другой и попробуйте снова.")
         try:
-            for key, values in company_id_dict.items():
-                company_vacancies = []
-                for p in range(pages):
-                    remaining_requests -= 1
-                    current_params = {
-                        "employer_id": values,
-                        "per_page": self.per_page,
-                        "page": p,
-                        "currency": DEFAULT_CURRENCY,
-                        "only_with_salary": with_salary
-                    }
-                    logger.info(f"Запрос {key} стр.{p}")
-                    response = requests.get(
-                        self.BASE_URL, params=current_params, headers=self.headers
-                    )  # Передаём заголовки
-                    response.raise_for_status()
-                    query_data = response.json().get("items", [])
-                    if remaining_requests > 0:
-                        time.sleep(delay)
-                    if query_data:
-                        company_vacancies.extend(query_data)
-                        logger.info(f"Страница {p} {key} получена")
-                    if p + 1 == pages and company_vacancies:
-                        all_vacancies.extend(company_vacancies)
-                        logger.info(f"Сбор данных для {key} завершён")
-            logger.info(f"Общий сбор данных завершён вакансий собрано {len(all_vacancies)}")
-            data = {"data": all_vacancies}
-            metadata = {
-                "_metadata": {
-                    "company_id_dict": company_id_dict,
-                    "area": area,
-                    "salary": salary
-                }
-            }
-            overwriting_json_data(data, self.file_path, self.file_name, metadata)
+            all_vacancies = self._collect(company_id_dict, pages, with_salary)
         except requests.exceptions.RequestException as err:
-            logger.warning(f"Ошибка запроса: {err}. Exit.")
-            exit(f"Ошибка запроса: {err}. Работа программы прекращена:\nНе удалось получить данные с сайта hh.ru, "
-                 f"проверьте соединение с интернетом и попробуйте снова.")
+            logger.warning("Ошибка запроса: %s", err)
+            raise
+        state = self.employers_state(all_vacancies, [str(v) for v in company_id_dict.values()])
+        self._save(all_vacancies, company_id_dict, area, salary, state)
+        return all_vacancies
+
+    def update_vacancies(self, company_id_dict: Dict, area: int, pages: int, salary: Any) -> list | None:
+        """Обновление файла данных только по устаревшим работодателям. Для работодателей, уже бывших в файле,
+        запрашиваются вакансии, опубликованные после последней известной даты публикации, новые работодатели
+        и работодатели, полностью запрошенные более INCREMENTAL_FULL_SWEEP_HOURS часов назад, запрашиваются
+        полностью (их вакансии в файле заменяются полученными - снятые с hh.ru вакансии удаляются).
+        Полученное сливается с файлом по id вакансии. Если файла нет или он получен
+        с другими area/salary - выполняется полный сбор. Возвращает новые и обновлённые вакансии.
+        При ошибке запроса к hh.ru файл данных не меняется, исключение передаётся вызывающему коду"""
+        if not cache_matches_params(self.file_path, self.file_name, area, salary):
+            logger.info("Файл данных отсутствует или получен с другими параметрами, полный сбор")
+            return self.get_vacancies(company_id_dict, area, pages, salary)
+        meta = read_json_metadata(self.file_path, self.file_name)
+        state = meta.get("employers_state", {})
+        keep_ids = {str(v) for v in company_id_dict.values()}
+        stale = {key: value for key, value in company_id_dict.items()
+                 if is_expired(parse_hh_datetime(state.get(str(value), {}).get("fetched_at")))}
+        removed = set(state) - keep_ids
+        if not stale and not removed:
+            logger.info("Данные по всем работодателям актуальны")
+            return []
+        since = {}
+        for hh_id in map(str, stale.values()):
+            employer_state = state.get(hh_id, {})
+            published = parse_hh_datetime(employer_state.get("published_at"))
+            swept = parse_hh_datetime(employer_state.get("swept_at"))
+            if published is not None and not is_expired(swept, INCREMENTAL_FULL_SWEEP_HOURS):
+                since[hh_id] = as_aware(published).isoformat()
+        logger.info("Обновление работодателей %s, из них по дате публикации %s", list(stale), len(since))
+        try:
+            fresh = self._collect(stale, pages, 1 if salary else 0, since) if stale else []
+        except requests.exceptions.RequestException as err:
+            logger.warning("Ошибка запроса: %s", err)
+            raise
+        refetched = {str(v) for v in stale.values()} - set(since)
+        fresh_ids = {vacancy.id for vacancy in fresh}
+
+        def merged():
+            for item in iter_json_vacancies(self.file_path, self.file_name):
+                vacancy = Vacancy.from_dict(item)
+                employer_id = vacancy.employer_id
+                if employer_id in keep_ids and employer_id not in refetched and vacancy.id not in fresh_ids:
+                    yield vacancy
+            yield from fresh
+
+        new_state = {key: value for key, value in state.items() if key in keep_ids}
+        new_state.update(self.employers_state(fresh, [str(v) for v in stale.values()], state, since))
+        self._save(merged(), company_id_dict, area, salary, new_state)
+        return fresh
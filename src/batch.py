@@ -0,0 +1,228 @@
+import json
+import os
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import requests
+
+from src.api_client import HHAPIClient, create_session
+from src.config import BATCH_INTERVAL_MINUTES, BATCH_MAX_PARALLEL, BATCH_REPORT_LIMIT, DATA_DIR, HH_API_AREA, \
+    HH_API_MAX_WORKERS, ID_COMPANY_ON_HHRU, INCREMENTAL_FETCH, METRICS_FILE, METRICS_FORMAT, ONLY_SALARY, PAGES, \
+    PIPELINE_MODE, REPORTS_DIR, RESPONSE_CACHE_MAX_MB, setup_logging
+from src.database_processings import DBManager
+from src.metrics import metrics
+from src.pipeline import run_pipeline
+from src.rate_limiter import TokenBucket
+from src.response_cache import ResponseCache
+from src.utils import cache_matches_params, dataset_fingerprint, iter_json_vacancies, read_json_metadata, \
+    write_json_atomic
+from src.vacancy import Vacancy
+
+modul_name = os.path.basename(__file__)
+logger = setup_logging(modul_name)
+
+
+class SearchProfile:
+    """Профиль поиска: набор работодателей, регионы, ключевые слова для отчёта, признак «только с зарплатой»,
+    количество страниц и период обновления в минутах"""
+
+    def __init__(self, name: str, employers: Dict[str, int] | None = None, areas: List[int] | None = None,
+                 keywords: List[str] | None = None, salary: Any = ONLY_SALARY, pages: int = PAGES,
+                 interval_minutes: float = BATCH_INTERVAL_MINUTES):
+        self.name = name
+        self.employers = employers or ID_COMPANY_ON_HHRU
+        self.areas = areas or [HH_API_AREA]
+        self.keywords = keywords or []
+        self.salary = salary
+        self.pages = pages
+        self.interval_minutes = interval_minutes
+
+    def __repr__(self):
+        return (f"SearchProfile({self.name!r}, employers={len(self.employers)}, areas={self.areas}, "
+                f"keywords={self.keywords}, every {self.interval_minutes} min)")
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any], interval_minutes: float = BATCH_INTERVAL_MINUTES) -> "SearchProfile":
+        if not data.get("name"):
+            raise ValueError("У профиля поиска не задано имя name")
+        return cls(name=data["name"], employers=data.get("employers"), areas=data.get("areas"),
+                   keywords=data.get("keywords"), salary=data.get("salary", ONLY_SALARY),
+                   pages=data.get("pages", PAGES), interval_minutes=data.get("interval_minutes", interval_minutes))
+
+
+class BatchJob:
+    """Задание планировщика - пара профиль-регион со своим файлом данных и отчётом.
+    close_missing=False, если работодатели задания в том же регионе встречаются и в других заданиях:
+    вакансии хранятся и закрываются по региону поиска задания, и внутри одного региона задание закрыло бы
+    вакансии другого"""
+
+    def __init__(self, profile: SearchProfile, area: int, close_missing: bool = True):
+        self.profile = profile
+        self.area = area
+        self.close_missing = close_missing
+        self.file_name = f"{profile.name}_{area}"
+        self.next_run = 0.0  # время следующего запуска по time.monotonic()
+        self.last_result: Dict[str, Any] = {}
+
+    def __repr__(self):
+        return f"BatchJob({self.file_name}, close_missing={self.close_missing})"
+
+
+def load_profiles(path: Path) -> Tuple[List[SearchProfile], Dict[str, Any]]:
+    """Чтение файла профилей (см. profiles.example.json). Возвращает профили и общие настройки файла
+    (interval_minutes - период обновления по умолчанию, max_parallel - одновременно обновляемых заданий)"""
+    with open(path, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    settings = {"interval_minutes": config.get("interval_minutes", BATCH_INTERVAL_MINUTES),
+                "max_parallel": config.get("max_parallel", BATCH_MAX_PARALLEL)}
+    profiles = [SearchProfile.from_dict(item, settings["interval_minutes"]) for item in config.get("profiles", [])]
+    names = Counter(profile.name for profile in profiles)
+    duplicates = [name for name, count in names.items() if count > 1]
+    if duplicates:
+        raise ValueError(f"Повторяющиеся имена профилей: {', '.join(duplicates)}")
+    return profiles, settings
+
+
+class BatchRunner:
+    """Пакетное обновление многих профилей поиска в одном процессе без интерактивного ввода.
+    Задания выполняются параллельно (max_parallel одновременно) с общими ограничителем частоты запросов,
+    HTTP-сессией, кэшем ответов и пулом подключений DBManager. Для каждого задания: при совпадении
+    параметров файла данных - обновление по устаревшим работодателям и загрузка файла (если его отпечаток
+    уже загружен - загрузка пропускается), иначе - полный сбор конвейером. После загрузки пишется отчёт
+    профиля в reports_dir. run_once - один проход по всем заданиям, run_forever - периодическое обновление
+    до вызова stop"""
+
+    def __init__(self, profiles: List[SearchProfile], db_manager: DBManager, max_parallel: int = BATCH_MAX_PARALLEL,
+                 rate_limiter: TokenBucket | None = None, session: requests.Session | None = None,
+                 response_cache: ResponseCache | None = None, data_dir: Path = DATA_DIR,
+                 reports_dir: Path = REPORTS_DIR):
+        self.db_manager = db_manager
+        self.max_parallel = max(1, max_parallel)
+        self.rate_limiter = rate_limiter or TokenBucket()
+        self.session = session or create_session(HH_API_MAX_WORKERS * self.max_parallel)
+        self.response_cache = response_cache or (ResponseCache() if RESPONSE_CACHE_MAX_MB > 0 else None)
+        self.data_dir = Path(data_dir)
+        self.reports_dir = Path(reports_dir)
+        self.jobs = self._plan_jobs(profiles)
+        self._stop = threading.Event()
+        logger.info("Заданий: %s, одновременно: %s", len(self.jobs), self.max_parallel)
+
+    @staticmethod
+    def _plan_jobs(profiles: List[SearchProfile]) -> List[BatchJob]:
+        """Задания по всем парам профиль-регион"""
+        pairs = [(profile, area) for profile in profiles for area in profile.areas]
+        usage = Counter((area, str(hh_id)) for profile, area in pairs for hh_id in profile.employers.values())
+        return [BatchJob(profile, area, all(usage[area, str(hh_id)] == 1 for hh_id in profile.employers.values()))
+                for profile, area in pairs]
+
+    def _client(self, job: BatchJob) -> HHAPIClient:
+        profile = job.profile
+        return HHAPIClient(company_id_dict=profile.employers, area=job.area, pages=profile.pages,
+                           salary=profile.salary, file_path=self.data_dir, file_name=job.file_name,
+                           rate_limiter=self.rate_limiter, session=self.session, response_cache=self.response_cache,
+                           autorun=False)
+
+    def _load_file(self, job: BatchJob) -> Dict[str, Any]:
+        """Загрузка файла данных задания в БД, если этот же набор ещё не загружен"""
+        meta = read_json_metadata(self.data_dir, job.file_name)
+        fingerprint = dataset_fingerprint(meta)
+        if self.db_manager.is_loaded(fingerprint, job.file_name):
+            logger.info("%s: данные в БД совпадают с файлом данных, загрузка пропущена", job.file_name)
+            return {"skipped": True}
+        vacancies = map(Vacancy.from_dict, iter_json_vacancies(self.data_dir, job.file_name))
+        stats = self.db_manager.save_to_database(vacancies, job.profile.employers, job.close_missing, job.area,
+                                                 job.file_name)
+        self.db_manager.record_dataset(fingerprint, meta, meta.get("records"), job.file_name)
+        return stats
+
+    def _report(self, job: BatchJob, load: Dict[str, Any], seconds: float) -> Dict[str, Any]:
+        """Отчёт профиля: результат загрузки, количество вакансий и статистика зарплат работодателей профиля,
+        вакансии по ключевым словам. Счётчики, статистика и поиск - по региону задания"""
+        db = self.db_manager
+        names = set(job.profile.employers)
+        report = {
+            "profile": job.profile.name,
+            "area": job.area,
+            "refreshed_at": datetime.now().isoformat(timespec="seconds"),
+            "seconds": round(seconds, 3),
+            "load": load,
+            "companies": [row for row in db.get_companies_and_vacancies_count(job.area) if row["name"] in names],
+            "salary_stats": [row for row in db.get_salary_stats(job.area) if row["company"] in names],
+            "keywords": {keyword: [row for row in db.search_vacancies(keyword, area=job.area)
+                                   if row["company"] in names]
+                         [:BATCH_REPORT_LIMIT] for keyword in job.profile.keywords},
+        }
+        write_json_atomic(report, self.reports_dir / f"{job.file_name}.json")
+        return report
+
+    def run_job(self, job: BatchJob) -> Dict[str, Any]:
+        """Обновление одного задания: сбор, загрузка в БД и отчёт"""
+        started = time.perf_counter()
+        client = self._client(job)
+        logger.info("%s: старт обновления", job.file_name)
+        if INCREMENTAL_FETCH and cache_matches_params(self.data_dir, job.file_name, job.area, client.salary):
+            client.update_vacancies(client.company, job.area, client.pages, client.salary)
+            load = self._load_file(job)
+        elif PIPELINE_MODE:
+            load = run_pipeline(client, self.db_manager, close_missing=job.close_missing)
+        else:
+            client.get_vacancies(client.company, job.area, client.pages, client.salary)
+            load = self._load_file(job)
+        seconds = time.perf_counter() - started
+        metrics.observe("batch_job_seconds", seconds, job=job.file_name)
+        logger.info("%s: обновлено за %.1f с: %s", job.file_name, seconds, load)
+        return self._report(job, load, seconds)
+
+    def _run_safe(self, job: BatchJob) -> Dict[str, Any]:
+        """Выполнение задания с перехватом ошибок: сбой одного задания не останавливает остальные.
+        Следующий запуск назначается через период обновления профиля и после ошибки"""
+        try:
+            job.last_result = {"job": job.file_name, "ok": True, "report": self.run_job(job)}
+        except Exception as err:
+            logger.error("%s: ошибка обновления: %s", job.file_name, err)
+            metrics.inc("batch_job_errors_total", job=job.file_name)
+            job.last_result = {"job": job.file_name, "ok": False, "error": str(err)}
+        finally:
+            job.next_run = time.monotonic() + job.profile.interval_minutes * 60
+        return job.last_result
+
+    def run_once(self) -> List[Dict[str, Any]]:
+        """Однократное обновление всех заданий, возвращает результаты в порядке заданий"""
+        with ThreadPoolExecutor(self.max_parallel, thread_name_prefix="batch") as executor:
+            results = list(executor.map(self._run_safe, self.jobs))
+        metrics.export(METRICS_FILE, METRICS_FORMAT)
+        return results
+
+    def run_forever(self) -> None:
+        """Периодическое обновление: задание запускается, когда подошло время его следующего запуска и оно
+        не выполняется в данный момент. Работает до вызова stop, начатые задания завершаются.
+        Метрики выгружаются из этого (планирующего) потока после завершения заданий"""
+        running = {}
+        executor = ThreadPoolExecutor(self.max_parallel, thread_name_prefix="batch")
+        try:
+            while not self._stop.is_set():
+                now = time.monotonic()
+                for job in self.jobs:
+                    if job not in running.values() and job.next_run <= now:
+                        running[executor.submit(self._run_safe, job)] = job
+                idle = [job.next_run for job in self.jobs if job not in running.values()]
+                timeout = max(0.0, min(idle, default=now + 60) - time.monotonic())
+                if running:
+                    done, _ = wait(running, timeout=min(timeout, 1.0), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        running.pop(future)
+                    if done:
+                        metrics.export(METRICS_FILE, METRICS_FORMAT)
+                else:
+                    self._stop.wait(timeout)
+        finally:
+            logger.info("Остановка, ожидание выполняемых заданий: %s", len(running))
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stop(self) -> None:
+        self._stop.set()
@@ -1,6 +1,10 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 from pathlib import Path
+from typing import Dict
 from dotenv import load_dotenv
 
 # Пути к файлам
@@ -14,12 +18,21 @@ DB_NAME = os.getenv('DB_NAME')
 DB_USER = os.getenv('DB_USER')
 DB_PASSWORD = os.getenv('DB_PASSWORD')
 DB_HOST = os.getenv('DB_HOST')
+DB_POOL_MIN = 1  # Минимальное количество соединений в пуле подключений к БД
+DB_POOL_MAX = 10  # Максимальное количество соединений в пуле, при исчерпании пула запросы ждут освобождения
+DB_POOL_HEALTH_CHECK_SECONDS = 60  # Соединение, простаивавшее дольше, проверяется запросом SELECT 1 перед выдачей
+DB_COPY_BATCH_SIZE = 10000  # Количество строк в одной порции COPY при массовой загрузке вакансий
+QUERY_CACHE_SIZE = 128  # Максимум результатов запросов в кэше DBManager, 0 - кэш отключён
+QUERY_CACHE_TTL_SECONDS = 300  # Время жизни результата запроса в кэше, сек
+DB_FETCH_BATCH_SIZE = 1000  # Количество строк, получаемых за раз при потоковом чтении результатов запроса
+SNAPSHOTS_ENABLED = True  # Сохранять при каждой загрузке снимок вакансий за день (история зарплат по дням)
+SNAPSHOT_RETENTION_DAYS = 90  # Срок хранения снимков, дней: секции старше удаляются после загрузки, 0 - бессрочно
 
 # Настройки API HH.ru
 HH_API_URL = "https://api.hh.ru/vacancies"
 HH_API_HEADERS = {"User-Agent": "MyVacancyParser/1.0 (alexxsmr@yandex.ru)"}
 HH_API_AREA = 113  # Код региона по умолчанию 113 — Россия. Можно 1 - Москва, 2 - Санкт-Петербург, 78 - Самара и т.д.
-PAGES = 1  # Количество запрашиваемых страниц по работодателю по умолчанию
+PAGES = 1  # Максимум запрашиваемых страниц по работодателю по умолчанию, 0 - все доступные страницы
 PER_PAGE = 100  # Количество строк на странице
 ID_COMPANY_ON_HHRU = {
     "Яндекс": 1740,
@@ -35,24 +48,96 @@ ID_COMPANY_ON_HHRU = {
 }  # - коды компаний на hh.ru
 ONLY_SALARY = 0  # Все варианты вакансий по зарплате, 1 - только с указанной зарплатой
 DEFAULT_CURRENCY = "RUR"  # Валюта по умолчанию
+KEEP_RAW_PAYLOAD = False  # Сохранять полный исходный элемент hh.ru в каждой вакансии (для отладки, увеличивает объём)
+HH_API_MAX_WORKERS = 4  # Количество параллельных потоков загрузки страниц
+HH_API_RATE_LIMIT = 5.0  # Средняя частота запросов к API, запросов в секунду (глобально на процесс)
+HH_API_RATE_BURST = 5  # Максимальное количество запросов «залпом» (ёмкость корзины токенов)
+HH_API_MAX_RETRIES = 5  # Количество повторов запроса при ответах 429/5xx и сетевых ошибках
+HH_API_BACKOFF_FACTOR = 0.5  # Базовая задержка экспоненциального отката, сек
+HH_API_BACKOFF_MAX = 30.0  # Максимальная задержка между повторами, сек
+HH_API_TIMEOUT = 10  # Таймаут одного запроса, сек
+HH_API_DEPTH_LIMIT = 2000  # Максимум вакансий, которые hh.ru отдаёт по одному запросу (глубина выдачи)
+HH_API_SEARCH_PERIOD_DAYS = 30  # Период публикации, в котором ищутся вакансии при разбиении запроса, дней
+HH_API_MIN_SLICE_MINUTES = 10  # Минимальная ширина окна по дате публикации при разбиении запроса, мин
 
 # Настройки файлов
 DEFAULT_JSON_FILE = "all_vacancies"  # Имя файла по умолчанию для сохранения полученных с hh.ru данных
-CACHE_EXPIRE_HOURS = 1  # Время существования файла данных в часах
+CACHE_EXPIRE_HOURS = 1  # Время существования файла данных в часах (отдельно для каждого работодателя)
+RESPONSE_CACHE_DIR = DATA_DIR / "responses"  # Директория кэша отдельных ответов API
+RESPONSE_CACHE_TTL_HOURS = CACHE_EXPIRE_HOURS  # Время жизни ответа API в кэше в часах
+RESPONSE_CACHE_MAX_MB = 200  # Максимальный размер кэша ответов API в МБ, 0 - кэш отключён
+PIPELINE_MODE = True  # Полный сбор загружать в БД конвейером, одновременно с получением страниц
+PIPELINE_QUEUE_SIZE = 16  # Максимум страниц вакансий в очереди между сбором и загрузкой в БД
+CURRENCY_RATES_URL = "https://api.hh.ru/dictionaries"  # Справочник hh.ru с курсами валют к рублю
+CURRENCY_RATES_FILE = DATA_DIR / "currency_rates.json"  # Локальная копия курсов валют
+CURRENCY_RATES_TTL_HOURS = 24  # Время жизни локальной копии курсов валют в часах
+INCREMENTAL_FETCH = True  # Обновлять устаревший файл данных запросом только новых вакансий (date_from)
+INCREMENTAL_FULL_SWEEP_HOURS = 24  # Не реже раза в столько часов работодатель запрашивается полностью, чтобы снятые
+# с hh.ru вакансии удалялись из файла данных и закрывались в БД
+
+# Пакетный режим (batch.py): много профилей поиска без интерактивного ввода
+PROFILES_FILE = BASE_DIR / "profiles.json"  # Профили поиска: работодатели, регионы, ключевые слова
+REPORTS_DIR = DATA_DIR / "reports"  # Директория отчётов по профилям
+BATCH_INTERVAL_MINUTES = 60  # Период обновления профиля по умолчанию, мин
+BATCH_MAX_PARALLEL = 2  # Количество профилей (пар профиль-регион), обновляемых одновременно
+BATCH_REPORT_LIMIT = 20  # Максимум вакансий по каждому ключевому слову в отчёте профиля
+
+# Метрики производительности
+METRICS_ENABLED = True  # Сбор метрик: время запросов и этапов, счётчики страниц, байтов и строк
+METRICS_PREFIX = "hh_"  # Префикс имён метрик при выгрузке в формате Prometheus
+METRICS_FORMAT = os.getenv("METRICS_FORMAT", "json")  # Формат выгрузки метрик в конце запуска: json или prometheus
+METRICS_FILE = LOGS_DIR / ("metrics.prom" if METRICS_FORMAT == "prometheus" else "metrics.json")  # Файл выгрузки
 
 # Логирование
 LOG_FORMAT = "%(asctime)s | %(levelname)s %(name)s, def: %(funcName)s, line:%(lineno)d, inf: %(message)s"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()  # Уровень логирования всех модулей: DEBUG, INFO, WARNING, ...
+LOG_FILE_MODE = "w"  # Режим открытия файлов логов: "w" - перезапись при каждом запуске, "a" - дополнение
+
+_log_queue = queue.SimpleQueue()  # Записи логов всех модулей, файлы пишет отдельный поток
+_log_files: Dict[str, logging.Handler] = {}
+
+
+class _LazyQueueHandler(QueueHandler):
+    """Постановка записи в очередь без форматирования: сообщение собирается из шаблона и аргументов
+    (logger.info("... %s", value)) уже в потоке записи файлов, а не в вызывающем потоке"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class _ModuleFileHandler(logging.Handler):
+    """Распределение записей из очереди по файлам логов модулей (имя логгера -> файл)"""
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        handler = _log_files.get(record.name)
+        if handler is not None:
+            handler.handle(record)
+        return True
+
+    def emit(self, record: logging.LogRecord) -> None:
+        pass
+
+
+_log_listener = QueueListener(_log_queue, _ModuleFileHandler())
+_log_listener.start()
+atexit.register(_log_listener.stop)  # дописываем оставшиеся в очереди записи при завершении
 
 
-def setup_logging(logger_name: str) -> logging.Logger:
-    """Централизованная конфигурация логирования для всего проекта"""
+def setup_logging(logger_name: str, level: str = LOG_LEVEL) -> logging.Logger:
+    """Централизованная конфигурация логирования для всего проекта. Каждый модуль пишет в свой файл,
+    запись в файлы выполняется отдельным потоком через очередь и не задерживает вызывающий код"""
     log_filename = f"{logger_name.split('.')[0]}.log"
     log_filepath = LOGS_DIR / log_filename
     logger = logging.getLogger(logger_name)
-    logger.setLevel(logging.DEBUG)
+    logger.setLevel(level)
     for handler in logger.handlers[:]:
         logger.removeHandler(handler)
-    file_handler = logging.FileHandler(log_filepath, "w", encoding="utf-8")
+    previous = _log_files.get(logger_name)
+    if previous is not None:
+        previous.close()
+    LOGS_DIR.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.FileHandler(log_filepath, LOG_FILE_MODE, encoding="utf-8")
     file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-    logger.addHandler(file_handler)
+    _log_files[logger_name] = file_handler
+    logger.addHandler(_LazyQueueHandler(_log_queue))
     return logger
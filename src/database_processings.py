@@ -1,196 +1,973 @@
+import io
 import os
+import re
+import threading
+import time
+import uuid
+from datetime import date, datetime, timedelta
+import pandas as pd
 import psycopg2
+from contextlib import contextmanager
 from psycopg2 import sql
-from typing import Dict, List
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extras import Json, execute_values
+from typing import Dict, Iterable, Iterator, List
 
-from src.config import DATA_DIR, DEFAULT_JSON_FILE, setup_logging, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST
-from src.utils import read_json_data
+from src.config import DATA_DIR, DEFAULT_JSON_FILE, setup_logging, DB_NAME, DB_USER, DB_PASSWORD, DB_HOST, \
+    DB_COPY_BATCH_SIZE, DB_FETCH_BATCH_SIZE, DB_POOL_MIN, DB_POOL_MAX, DB_POOL_HEALTH_CHECK_SECONDS, \
+    QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS, SNAPSHOTS_ENABLED, SNAPSHOT_RETENTION_DAYS
+from src.metrics import metrics
+from src.query_cache import QueryCache, cached_query
+from src.transform import FRAME_COLUMNS, batched, load_currency_rates, transform_vacancies, unconverted_ids, \
+    vacancies_frame
+from src.utils import dataset_fingerprint, iter_json_vacancies, read_json_metadata
+from src.vacancy import Vacancy
 
 modul_name = os.path.basename(__file__)
 logger = setup_logging(modul_name)
 
+UNKNOWN_AREA = -1  # Регион поиска вакансий, загруженных до секционирования по регионам (миграция 6)
+
+# Миграции схемы БД: (версия, описание, SQL-инструкции). Применяются по порядку один раз,
+# номер последней применённой версии хранится в таблице schema_migrations
+SCHEMA_MIGRATIONS = [
+    (1, "Таблицы employers и vacancies", [
+        """
+        CREATE TABLE IF NOT EXISTS employers (
+            employer_id SERIAL PRIMARY KEY,
+            hh_id INTEGER UNIQUE NOT NULL,
+            name VARCHAR(255) NOT NULL);
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS vacancies (
+            vacancy_id SERIAL PRIMARY KEY,
+            employer_id INTEGER REFERENCES employers(employer_id),
+            title VARCHAR(255) NOT NULL,
+            salary_from INTEGER,
+            salary_to INTEGER,
+            currency VARCHAR(10),
+            url VARCHAR(512) UNIQUE,
+            CONSTRAINT fk_employer FOREIGN KEY(employer_id) REFERENCES employers(employer_id));
+        """,
+    ]),
+    (2, "Идентификатор вакансии hh.ru, хэш содержимого и закрытие пропавших вакансий", [
+        "ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS hh_vacancy_id BIGINT;",
+        "ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS content_hash CHAR(32);",
+        "ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS first_seen_at TIMESTAMP NOT NULL DEFAULT now();",
+        "ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT now();",
+        "ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS closed_at TIMESTAMP;",
+        # Ранее загруженные строки получают id из ссылки вида https://hh.ru/vacancy/123456
+        """
+        UPDATE vacancies SET hh_vacancy_id = substring(url FROM '/vacancy/([0-9]+)')::BIGINT
+        WHERE hh_vacancy_id IS NULL;
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS vacancies_hh_vacancy_id_key ON vacancies (hh_vacancy_id);",
+        "CREATE INDEX IF NOT EXISTS vacancies_open_employer_idx ON vacancies (employer_id) WHERE closed_at IS NULL;",
+    ]),
+    (3, "Полнотекстовый (russian) и триграммный поиск по названию вакансии", [
+        """
+        ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS title_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('russian', coalesce(title, ''))) STORED;
+        """,
+        "CREATE INDEX IF NOT EXISTS vacancies_title_tsv_idx ON vacancies USING GIN (title_tsv);",
+        # Расширение pg_trgm может быть недоступно без прав суперпользователя - тогда поиск по подстроке
+        # остаётся без индекса, а полнотекстовый поиск работает как обычно
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS pg_trgm;
+            CREATE INDEX IF NOT EXISTS vacancies_title_trgm_idx ON vacancies USING GIN (title gin_trgm_ops);
+        EXCEPTION WHEN insufficient_privilege OR undefined_file OR feature_not_supported THEN
+            RAISE NOTICE 'pg_trgm недоступен, триграммный индекс не создан';
+        END $$;
+        """,
+    ]),
+    (4, "Средняя точка вилки зарплаты и материализованная статистика зарплат", [
+        # Если указана только одна граница вилки - берётся она
+        """
+        ALTER TABLE vacancies ADD COLUMN IF NOT EXISTS salary_mid INTEGER GENERATED ALWAYS AS (
+            CASE
+                WHEN salary_from IS NOT NULL AND salary_to IS NOT NULL THEN (salary_from + salary_to)/2
+                WHEN salary_from IS NOT NULL THEN salary_from
+                WHEN salary_to IS NOT NULL THEN salary_to
+            END) STORED;
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS vacancies_open_salary_mid_idx ON vacancies (salary_mid DESC NULLS LAST)
+            WHERE closed_at IS NULL;
+        """,
+        # employer_id = 0 - статистика по всем открытым вакансиям
+        """
+        CREATE MATERIALIZED VIEW IF NOT EXISTS salary_stats AS
+            SELECT employer_id, COUNT(*) AS vacancies_count, AVG(salary_mid) AS avg_salary,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_mid) AS median_salary,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_mid) AS p90_salary
+            FROM vacancies
+            WHERE closed_at IS NULL AND salary_mid IS NOT NULL AND employer_id IS NOT NULL
+            GROUP BY employer_id
+            UNION ALL
+            SELECT 0, COUNT(*), AVG(salary_mid),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_mid),
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_mid)
+            FROM vacancies
+            WHERE closed_at IS NULL AND salary_mid IS NOT NULL;
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS salary_stats_employer_key ON salary_stats (employer_id);",
+    ]),
+    (5, "Отпечатки загруженных наборов данных", [
+        """
+        CREATE TABLE IF NOT EXISTS loaded_datasets (
+            dataset VARCHAR(255) PRIMARY KEY,
+            fingerprint CHAR(64) NOT NULL,
+            params JSONB,
+            records INTEGER,
+            loaded_at TIMESTAMP NOT NULL DEFAULT now());
+        """,
+    ]),
+    (6, "Секционирование вакансий по региону и история снимков по дням", [
+        # Вакансии без hh_vacancy_id (не удалось разобрать ссылку в миграции 2) нельзя перенести в таблицу
+        # с ключом (area_id, hh_vacancy_id): миграция прерывается, чтобы они не были потеряны молча
+        """
+        DO $$
+        DECLARE
+            missing BIGINT;
+        BEGIN
+            SELECT COUNT(*) INTO missing FROM vacancies WHERE hh_vacancy_id IS NULL;
+            IF missing > 0 THEN
+                RAISE EXCEPTION 'Миграция 6 прервана: вакансий без hh_vacancy_id - %, их нужно исправить '
+                                'или удалить (либо пересоздать таблицы create_tables(rebuild=True))', missing;
+            END IF;
+        END $$;
+        """,
+        # Статистика зависит от таблицы вакансий и пересоздаётся с разбивкой по регионам
+        "DROP MATERIALIZED VIEW IF EXISTS salary_stats;",
+        "CREATE SEQUENCE IF NOT EXISTS vacancies_id_seq;",
+        # Уникальность в секционированной таблице обеспечивается только вместе с ключом секционирования,
+        # поэтому первичный ключ и ключ вакансии hh.ru включают регион, а отдельная уникальность url снята
+        """
+        CREATE TABLE vacancies_partitioned (
+            vacancy_id BIGINT NOT NULL DEFAULT nextval('vacancies_id_seq'),
+            area_id INTEGER NOT NULL DEFAULT -1,
+            hh_vacancy_id BIGINT NOT NULL,
+            employer_id INTEGER REFERENCES employers(employer_id),
+            title VARCHAR(255) NOT NULL,
+            salary_from INTEGER,
+            salary_to INTEGER,
+            currency VARCHAR(10),
+            url VARCHAR(512),
+            content_hash CHAR(32),
+            first_seen_at TIMESTAMP NOT NULL DEFAULT now(),
+            updated_at TIMESTAMP NOT NULL DEFAULT now(),
+            closed_at TIMESTAMP,
+            title_tsv tsvector GENERATED ALWAYS AS (to_tsvector('russian', coalesce(title, ''))) STORED,
+            salary_mid INTEGER GENERATED ALWAYS AS (
+                CASE
+                    WHEN salary_from IS NOT NULL AND salary_to IS NOT NULL THEN (salary_from + salary_to)/2
+                    WHEN salary_from IS NOT NULL THEN salary_from
+                    WHEN salary_to IS NOT NULL THEN salary_to
+                END) STORED,
+            CONSTRAINT vacancies_area_vacancy_pkey PRIMARY KEY (area_id, vacancy_id),
+            CONSTRAINT vacancies_area_hh_vacancy_id_key UNIQUE (area_id, hh_vacancy_id)
+        ) PARTITION BY LIST (area_id);
+        """,
+        # Ранее загруженные вакансии не содержат региона и переносятся в секцию неизвестного региона
+        "CREATE TABLE vacancies_area_unknown PARTITION OF vacancies_partitioned FOR VALUES IN (-1);",
+        """
+        INSERT INTO vacancies_partitioned (vacancy_id, hh_vacancy_id, employer_id, title, salary_from, salary_to,
+                                           currency, url, content_hash, first_seen_at, updated_at, closed_at)
+        SELECT vacancy_id, hh_vacancy_id, employer_id, title, salary_from, salary_to,
+               currency, url, content_hash, first_seen_at, updated_at, closed_at
+        FROM vacancies;
+        """,
+        """
+        SELECT setval('vacancies_id_seq', COALESCE((SELECT MAX(vacancy_id) FROM vacancies_partitioned), 0) + 1,
+                      false);
+        """,
+        "DROP TABLE vacancies;",
+        "ALTER TABLE vacancies_partitioned RENAME TO vacancies;",
+        "ALTER SEQUENCE vacancies_id_seq OWNED BY vacancies.vacancy_id;",
+        # Индексы секционированной таблицы создаются в каждой секции, в том числе в секциях, добавленных позже
+        "CREATE INDEX vacancies_open_employer_idx ON vacancies (employer_id) WHERE closed_at IS NULL;",
+        "CREATE INDEX vacancies_title_tsv_idx ON vacancies USING GIN (title_tsv);",
+        """
+        CREATE INDEX vacancies_open_salary_mid_idx ON vacancies (salary_mid DESC NULLS LAST)
+            WHERE closed_at IS NULL;
+        """,
+        """
+        DO $$
+        BEGIN
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                CREATE INDEX vacancies_title_trgm_idx ON vacancies USING GIN (title gin_trgm_ops);
+            END IF;
+        END $$;
+        """,
+        # area_id = 0 - все регионы, employer_id = 0 - все работодатели
+        """
+        CREATE MATERIALIZED VIEW salary_stats AS
+            SELECT COALESCE(area_id, 0) AS area_id, COALESCE(employer_id, 0) AS employer_id,
+                   COUNT(*) AS vacancies_count, AVG(salary_mid) AS avg_salary,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_mid) AS median_salary,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_mid) AS p90_salary
+            FROM vacancies
+            WHERE closed_at IS NULL AND salary_mid IS NOT NULL
+            GROUP BY GROUPING SETS ((area_id, employer_id), (area_id), (employer_id), ())
+            HAVING GROUPING(employer_id) = 1 OR employer_id IS NOT NULL;
+        """,
+        "CREATE UNIQUE INDEX salary_stats_area_employer_key ON salary_stats (area_id, employer_id);",
+        # История: состояние вакансий на дату загрузки, секция на каждый день удаляется целиком по истечении
+        # срока хранения (см. DBManager.drop_old_snapshots)
+        """
+        CREATE TABLE IF NOT EXISTS vacancy_snapshots (
+            snapshot_date DATE NOT NULL,
+            area_id INTEGER NOT NULL,
+            hh_vacancy_id BIGINT NOT NULL,
+            employer_id INTEGER,
+            title VARCHAR(255),
+            salary_from INTEGER,
+            salary_to INTEGER,
+            salary_mid INTEGER,
+            currency VARCHAR(10),
+            PRIMARY KEY (snapshot_date, area_id, hh_vacancy_id)
+        ) PARTITION BY RANGE (snapshot_date);
+        """,
+        "CREATE INDEX IF NOT EXISTS vacancy_snapshots_hh_vacancy_id_idx ON vacancy_snapshots (hh_vacancy_id);",
+        """
+        CREATE INDEX IF NOT EXISTS vacancy_snapshots_area_employer_idx
+            ON vacancy_snapshots (area_id, employer_id);
+        """,
+    ]),
+    (7, "Статистика по всем регионам без повторов вакансий из пересекающихся регионов", [
+        # Поиск открытой копии вакансии в других секциях (см. DBManager._area_filter)
+        """
+        CREATE INDEX IF NOT EXISTS vacancies_open_hh_vacancy_id_idx ON vacancies (hh_vacancy_id)
+            WHERE closed_at IS NULL;
+        """,
+        "DROP MATERIALIZED VIEW IF EXISTS salary_stats;",
+        # Статистика региона считается по его секции, по всем регионам (area_id = 0) - по вакансиям без
+        # повторов: вакансия, найденная по Москве и по России, учитывается один раз
+        """
+        CREATE MATERIALIZED VIEW salary_stats AS
+            WITH open_vacancies AS (
+                SELECT area_id, hh_vacancy_id, employer_id, salary_mid
+                FROM vacancies
+                WHERE closed_at IS NULL AND salary_mid IS NOT NULL
+            ), distinct_vacancies AS (
+                SELECT DISTINCT ON (hh_vacancy_id) employer_id, salary_mid
+                FROM open_vacancies
+                ORDER BY hh_vacancy_id, area_id
+            )
+            SELECT area_id, COALESCE(employer_id, 0) AS employer_id,
+                   COUNT(*) AS vacancies_count, AVG(salary_mid) AS avg_salary,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_mid) AS median_salary,
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_mid) AS p90_salary
+            FROM open_vacancies
+            GROUP BY GROUPING SETS ((area_id, employer_id), (area_id))
+            HAVING GROUPING(employer_id) = 1 OR employer_id IS NOT NULL
+            UNION ALL
+            SELECT 0, COALESCE(employer_id, 0),
+                   COUNT(*), AVG(salary_mid),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY salary_mid),
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY salary_mid)
+            FROM distinct_vacancies
+            GROUP BY GROUPING SETS ((employer_id), ())
+            HAVING GROUPING(employer_id) = 1 OR employer_id IS NOT NULL;
+        """,
+        "CREATE UNIQUE INDEX salary_stats_area_employer_key ON salary_stats (area_id, employer_id);",
+    ]),
+]
+
+# Режимы поиска: оператор, которым соединяются слова запроса в tsquery
+SEARCH_MODES = {"and": " & ", "or": " | ", "phrase": " <-> "}
+
 
 class DBManager:
-    """Получение данных с hh.ru и распределение данных по таблицам в соответствии с методами"""
+    """Получение данных с hh.ru и распределение данных по таблицам в соответствии с методами.
+    Подключения берутся из пула, поэтому методы запросов можно вызывать из нескольких потоков одновременно.
+    Поддерживает протокол контекстного менеджера: при выходе из блока with пул закрывается.
+    Результаты get_* запросов кэшируются в памяти до следующей загрузки данных (cache_size=0 - без кэша)"""
 
-    def __init__(self, file_path=DATA_DIR, file_name=DEFAULT_JSON_FILE):
-        """Инициализация подключения к БД и получения данных"""
-        self.conn = psycopg2.connect(dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST)
-        self.conn.autocommit = True
+    def __init__(self, file_path=DATA_DIR, file_name=DEFAULT_JSON_FILE, min_conn: int = DB_POOL_MIN,
+                 max_conn: int = DB_POOL_MAX, cache_size: int = QUERY_CACHE_SIZE,
+                 cache_ttl: float = QUERY_CACHE_TTL_SECONDS, read_data: bool = True):
+        """Инициализация пула подключений к БД и получения данных.
+        read_data=False - без файла данных, вакансии передаются напрямую в save_to_database"""
+        self.query_cache = QueryCache(cache_size, cache_ttl) if cache_size > 0 else None
+        self.data_version = 0
+        self.min_conn = min_conn
+        self.max_conn = max(min_conn, max_conn)
+        self._slots = threading.BoundedSemaphore(self.max_conn)
+        self._last_used = {}
+        self._trigram_index = None  # есть ли триграммный индекс по названию, см. _has_trigram_index
+        self.pool = self._create_pool(DB_NAME)
         self.file_path = file_path
         self.file_name = file_name
-        logger.info(f"Инициализатор")
-        self.all_data = read_json_data(self.file_path, self.file_name)
-        self.all_vacancies = self.all_data[0].get("data")
-        self.company = self.all_data[1].get("_metadata").get("company_id_dict")
+        logger.info("Инициализатор")
+        self.metadata = read_json_metadata(self.file_path, self.file_name) if read_data else {}
+        if read_data and not self.metadata:
+            logger.error("Ошибка чтения файла")
+            exit("Ошибка чтения файла данных. Попробуйте запустить программу снова.")
+        self.company = self.metadata.get("_metadata", {}).get("company_id_dict", {})
+        self.area = self.metadata.get("_metadata", {}).get("area", UNKNOWN_AREA)
+        self.fingerprint = dataset_fingerprint(self.metadata)
+
+    def __iter__(self) -> Iterator[Vacancy]:
+        """Итерируем вакансии из файла данных лениво, по одной"""
+        return map(Vacancy.from_dict, iter_json_vacancies(self.file_path, self.file_name))
 
-    def __iter__(self) -> iter:
-        """Итерируем список вакансий"""
-        return iter(self.all_vacancies)
+    def __enter__(self) -> "DBManager":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.close()
 
     def __del__(self):
-        """Закрытие подключения при удалении объекта"""
-        if hasattr(self, 'conn'):
-            self.conn.close()
-            logger.info("Подключение к БД закрыто")
+        """Закрытие подключений при удалении объекта"""
+        self.close()
+
+    def close(self) -> None:
+        """Закрытие всех подключений пула"""
+        pool = getattr(self, 'pool', None)
+        if pool is not None and not pool.closed:
+            pool.closeall()
+            logger.info("Подключения к БД закрыты")
+
+    def _bump_data_version(self) -> None:
+        """Смена версии набора данных: ранее закэшированные результаты запросов больше не используются"""
+        self.data_version += 1
+        if self.query_cache is not None:
+            self.query_cache.clear()
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Счётчики кэша результатов запросов: попадания, промахи, размер"""
+        return self.query_cache.stats() if self.query_cache is not None else {"hits": 0, "misses": 0, "size": 0}
+
+    def _create_pool(self, database_name: str) -> ThreadedConnectionPool:
+        """Создание пула подключений к заданной БД"""
+        pool = ThreadedConnectionPool(self.min_conn, self.max_conn, dbname=database_name, user=DB_USER,
+                                      password=DB_PASSWORD, host=DB_HOST)
+        logger.info("Пул подключений к БД %s: %s-%s", database_name, self.min_conn, self.max_conn)
+        return pool
+
+    def _is_healthy(self, conn) -> bool:
+        """Проверка соединения перед выдачей из пула. Долго простаивавшие соединения проверяются запросом"""
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_POOL_HEALTH_CHECK_SECONDS:
+            return True
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            return False
+
+    @contextmanager
+    def _connection(self) -> Iterator:
+        """Подключение из пула в режиме autocommit. Если свободных подключений нет - ожидание освобождения"""
+        self._slots.acquire()
+        conn = None
+        try:
+            pool = self.pool
+            conn = pool.getconn()
+            if not self._is_healthy(conn):
+                logger.warning("Неисправное подключение заменено новым")
+                pool.putconn(conn, close=True)
+                conn = None
+                conn = pool.getconn()
+            conn.autocommit = True
+            yield conn
+        finally:
+            if conn is not None:
+                if not conn.closed and conn.status != psycopg2.extensions.STATUS_READY:
+                    conn.rollback()
+                self._last_used[id(conn)] = time.monotonic()
+                pool.putconn(conn, close=bool(conn.closed))
+            self._slots.release()
 
     def _execute_query(self, query: str, params=None) -> List[Dict]:
         """Общий метод выполнения SQL-запросов."""
         try:
-            with self.conn.cursor() as cur:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute(query, params or [])
                 columns = [desc[0] for desc in cur.description]
                 return [dict(zip(columns, row)) for row in cur.fetchall()]
         except psycopg2.Error as er:
-            logger.error(f"Ошибка: {er}")
+            logger.error("Ошибка: %s", er)
             return []
 
+    def _stream_query(self, query: str, params=None, batch_size: int = DB_FETCH_BATCH_SIZE) -> Iterator[Dict]:
+        """Потоковое выполнение SQL-запроса через именованный (серверный) курсор. Строки запрашиваются
+        порциями по batch_size и отдаются по одной, поэтому память не зависит от размера результата.
+        Подключение занято, пока генератор не исчерпан или не закрыт"""
+        with self._connection() as conn:
+            conn.autocommit = False  # серверный курсор существует только внутри транзакции
+            try:
+                with conn.cursor(name=f"stream_{uuid.uuid4().hex}") as cur:
+                    cur.itersize = batch_size
+                    cur.execute(query, params or [])
+                    columns = None
+                    while rows := cur.fetchmany(batch_size):
+                        if columns is None:
+                            columns = [desc[0] for desc in cur.description]
+                        for row in rows:
+                            yield dict(zip(columns, row))
+                conn.commit()
+            except psycopg2.Error as er:
+                logger.error("Ошибка: %s", er)
+                conn.rollback()
+
     def create_database(self, database_name: str = "hh_vacancies"):
         """Проверяет существование БД с заданным именем, создает при ее отсутствии и совершает переподключение
          на заданную БД"""
-        logger.info(f"Старт. Создание БД {database_name} если не существует")
-        with self.conn.cursor() as cur:
+        logger.info("Старт. Создание БД %s если не существует", database_name)
+        with self._connection() as conn, conn.cursor() as cur:
             cur.execute("SELECT 1 FROM pg_database WHERE datname = %s;",
                         (database_name,))
             db_exists = cur.fetchone()
             if not db_exists:
                 cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(database_name)))
-                logger.info(f"БД {database_name} создана")
-        self.conn.close()
-        self.conn = psycopg2.connect(dbname=database_name, user=DB_USER, password=DB_PASSWORD, host=DB_HOST)
-        logger.info(f"Переключение на БД {database_name}")
-        self.conn.autocommit = True
-
-    def create_tables(self):
-        """Пересоздание или создание таблиц в БД"""
-        with self.conn.cursor() as cur:
-            try:
-                # Удаляем таблицу employers если существует
-                cur.execute("""DROP TABLE IF EXISTS employers CASCADE;""")
-                # Создание таблицы employers
+                logger.info("БД %s создана", database_name)
+        self.close()
+        self._last_used.clear()
+        self.pool = self._create_pool(database_name)
+        self._trigram_index = None
+        self._bump_data_version()
+        logger.info("Переключение на БД %s", database_name)
+
+    def create_tables(self, rebuild: bool = False):
+        """Создание или миграция таблиц в БД до актуальной версии схемы. Применяются только ещё
+        не применённые миграции, существующие данные сохраняются. rebuild=True - удалить таблицы и создать заново"""
+        try:
+            if rebuild:
+                with self._connection() as conn, conn.cursor() as cur:
+                    cur.execute("""
+                        DROP TABLE IF EXISTS vacancy_snapshots, vacancies, employers, loaded_datasets,
+                            schema_migrations CASCADE;
+                    """)
+                    logger.info("Таблицы employers, vacancies и vacancy_snapshots удалены")
+                self._bump_data_version()
+            self._migrate()
+        except psycopg2.Error as er:
+            logger.error("Ошибка создания таблиц: %s", er)
+            raise
+
+    def _migrate(self) -> None:
+        """Применение недостающих миграций схемы одной транзакцией"""
+        with self._transaction() as cur:
+            # Блокировка не даёт двум процессам одновременно мигрировать одну БД
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext('schema_migrations'));")
+            cur.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT,
+                    applied_at TIMESTAMP NOT NULL DEFAULT now());
+            """)
+            cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations;")
+            current = cur.fetchone()[0]
+            for version, description, statements in SCHEMA_MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    cur.execute(statement)
+                cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s);",
+                            (version, description))
+                logger.info("Применена миграция %s: %s", version, description)
+        self._trigram_index = None
+        logger.info("Схема БД актуальна, версия %s", SCHEMA_MIGRATIONS[-1][0])
+
+    def is_loaded(self, fingerprint: str | None = None, dataset: str | None = None) -> bool:
+        """Проверка одним запросом, что схема БД актуальна и в неё уже загружен набор данных с тем же
+        отпечатком (по умолчанию - отпечаток файла данных). Тогда создание таблиц и загрузку можно пропустить.
+        dataset - имя набора данных, по умолчанию - имя файла данных"""
+        fingerprint = self.fingerprint if fingerprint is None else fingerprint
+        if not fingerprint:
+            return False
+        try:
+            with self._connection() as conn, conn.cursor() as cur:
                 cur.execute("""
-                    CREATE TABLE employers (
-                        employer_id SERIAL PRIMARY KEY,
-                        hh_id INTEGER UNIQUE NOT NULL,
-                        name VARCHAR(255) NOT NULL);
-                """)
-                # Удаляем таблицу vacancies если существует
-                cur.execute("""DROP TABLE IF EXISTS vacancies;""")
-                # Создание таблицы vacancies
+                    SELECT (SELECT MAX(version) FROM schema_migrations),
+                           (SELECT fingerprint FROM loaded_datasets WHERE dataset = %s)
+                """, (dataset or self.file_name,))
+                version, loaded = cur.fetchone()
+        except psycopg2.Error as er:  # таблиц ещё нет
+            logger.info("Отпечаток загруженных данных недоступен: %s", er)
+            return False
+        return version == SCHEMA_MIGRATIONS[-1][0] and loaded == fingerprint
+
+    def _record_dataset(self, cur, fingerprint: str, metadata: Dict, records: int | None,
+                        dataset: str | None = None) -> None:
+        """Запись отпечатка загруженного набора данных в рамках транзакции загрузки"""
+        cur.execute("""
+            INSERT INTO loaded_datasets (dataset, fingerprint, params, records) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (dataset) DO UPDATE SET
+                fingerprint = EXCLUDED.fingerprint,
+                params = EXCLUDED.params,
+                records = EXCLUDED.records,
+                loaded_at = now()
+        """, (dataset or self.file_name, fingerprint, Json(metadata.get("_metadata", {})), records))
+
+    def record_dataset(self, fingerprint: str | None, metadata: Dict, records: int | None = None,
+                       dataset: str | None = None) -> None:
+        """Отметка, что содержимое БД соответствует набору данных с отпечатком fingerprint
+        (например, после загрузки конвейером, когда файл данных записывается попутно)"""
+        if not fingerprint:
+            return
+        with self._transaction() as cur:
+            self._record_dataset(cur, fingerprint, metadata, records, dataset)
+        logger.info("Отпечаток набора данных %s сохранён", dataset or self.file_name)
+
+    @contextmanager
+    def _transaction(self) -> Iterator:
+        """Курсор в рамках одной транзакции: фиксация при успехе, откат при ошибке"""
+        with self._connection() as conn:
+            conn.autocommit = False
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+    @staticmethod
+    def _save_employers(cur, company: Dict) -> Dict[int, int]:
+        """Вставка работодателей одним запросом, возвращает соответствие hh_id -> employer_id"""
+        execute_values(
+            cur,
+            "INSERT INTO employers (hh_id, name) VALUES %s ON CONFLICT (hh_id) DO NOTHING",
+            [(int(hh_id), company_name) for company_name, hh_id in company.items()]
+        )
+        cur.execute("SELECT hh_id, employer_id FROM employers WHERE hh_id = ANY(%s)",
+                    ([int(hh_id) for hh_id in company.values()],))
+        return dict(cur.fetchall())
+
+    @staticmethod
+    def _copy_frame(cur, table: str, frame: pd.DataFrame, batch_size: int = DB_COPY_BATCH_SIZE) -> int:
+        """Загрузка таблицы pandas в таблицу БД через COPY FROM STDIN порциями по batch_size строк"""
+        copy_sql = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+            sql.Identifier(table), sql.SQL(", ").join(map(sql.Identifier, frame.columns))
+        ).as_string(cur)
+        for start in range(0, len(frame), batch_size):
+            buffer = io.StringIO()
+            # Пропуски пишутся пустым полем и в формате csv читаются как NULL
+            frame.iloc[start:start + batch_size].to_csv(buffer, header=False, index=False)
+            buffer.seek(0)
+            cur.copy_expert(copy_sql, buffer)
+        return len(frame)
+
+    @staticmethod
+    def _ensure_partition(cur, parent: str, name: str, bounds: str, params=None) -> None:
+        """Создание секции name таблицы parent с границами bounds (FOR VALUES ...), если её ещё нет.
+        Создание секции всё равно требует исключительной блокировки родительской таблицы до конца транзакции,
+        поэтому она берётся заранее и только при отсутствии секции: параллельные загрузки создают секции
+        по очереди и не пытаются создать одну секцию дважды"""
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if cur.fetchone()[0]:
+            return
+        cur.execute(sql.SQL("LOCK TABLE {} IN ACCESS EXCLUSIVE MODE").format(sql.Identifier(parent)))
+        cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+        if cur.fetchone()[0]:
+            return
+        cur.execute(sql.SQL("CREATE TABLE {} PARTITION OF {} FOR VALUES " + bounds).format(
+            sql.Identifier(name), sql.Identifier(parent)), params)
+        logger.info("Создана секция %s таблицы %s", name, parent)
+
+    def _ensure_partitions(self, area: int, snapshot_date: date | None) -> None:
+        """Секция vacancies региона поиска area и секция снимков за день snapshot_date (None - без снимка).
+        Создаются отдельной короткой транзакцией до загрузки, чтобы исключительная блокировка родительской
+        таблицы не держалась всю загрузку"""
+        with self._transaction() as cur:
+            name = "vacancies_area_unknown" if area == UNKNOWN_AREA else f"vacancies_area_{area}"
+            self._ensure_partition(cur, "vacancies", name, "IN (%s)", (area,))
+            if snapshot_date is not None:
+                self._ensure_partition(cur, "vacancy_snapshots", f"vacancy_snapshots_{snapshot_date:%Y%m%d}",
+                                       "FROM (%s) TO (%s)", (snapshot_date, snapshot_date + timedelta(days=1)))
+
+    @staticmethod
+    def _save_snapshot(cur, area: int, snapshot_date: date) -> int:
+        """Снимок загружаемых вакансий региона area за день snapshot_date в секцию vacancy_snapshots этого дня.
+        Повторная загрузка в тот же день обновляет снимок"""
+        cur.execute("""
+            INSERT INTO vacancy_snapshots (snapshot_date, area_id, hh_vacancy_id, employer_id, title, salary_from,
+                                           salary_to, salary_mid, currency)
+            SELECT DISTINCT ON (hh_vacancy_id)
+                   %s, %s, hh_vacancy_id, employer_id, title, salary_from, salary_to, salary_mid, currency
+            FROM vacancies_stage
+            ORDER BY hh_vacancy_id
+            ON CONFLICT (snapshot_date, area_id, hh_vacancy_id) DO UPDATE SET
+                employer_id = EXCLUDED.employer_id,
+                title = EXCLUDED.title,
+                salary_from = EXCLUDED.salary_from,
+                salary_to = EXCLUDED.salary_to,
+                salary_mid = EXCLUDED.salary_mid,
+                currency = EXCLUDED.currency
+        """, (snapshot_date, area))
+        return cur.rowcount
+
+    def drop_old_snapshots(self, keep_days: int = SNAPSHOT_RETENTION_DAYS) -> List[str]:
+        """Удаление секций снимков старше keep_days дней целиком (DROP TABLE вместо DELETE: без
+        построчного удаления и последующей очистки таблицы). keep_days=0 - снимки хранятся бессрочно.
+        Возвращает имена удалённых секций"""
+        if keep_days <= 0:
+            return []
+        oldest = date.today() - timedelta(days=keep_days)
+        dropped = []
+        with self._transaction() as cur:
+            cur.execute("""
+                SELECT c.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                WHERE i.inhparent = 'vacancy_snapshots'::regclass
+            """)
+            for (name,) in cur.fetchall():
+                match = re.fullmatch(r"vacancy_snapshots_(\d{8})", name)
+                if match and datetime.strptime(match.group(1), "%Y%m%d").date() < oldest:
+                    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(name)))
+                    dropped.append(name)
+        if dropped:
+            self._bump_data_version()
+            logger.info("Удалены секции снимков старше %s дн.: %s", keep_days, ", ".join(dropped))
+        return dropped
+
+    @staticmethod
+    def _close_dropped_employers(cur, dataset: str, company: Dict, area: int) -> int:
+        """Закрытие открытых вакансий региона поиска area у работодателей, которые были в предыдущей загрузке
+        набора данных dataset (loaded_datasets), но исключены из словаря работодателей company"""
+        cur.execute("SELECT params -> 'company_id_dict' FROM loaded_datasets WHERE dataset = %s", (dataset,))
+        row = cur.fetchone()
+        previous = (row[0] if row else None) or {}
+        dropped = {int(hh_id) for hh_id in previous.values()} - {int(hh_id) for hh_id in company.values()}
+        if not dropped:
+            return 0
+        cur.execute("""
+            UPDATE vacancies v SET closed_at = now()
+            FROM employers e
+            WHERE v.employer_id = e.employer_id
+              AND v.closed_at IS NULL
+              AND v.area_id = %s
+              AND e.hh_id = ANY(%s)
+        """, (area, sorted(dropped)))
+        logger.info("Закрыты вакансии исключённых работодателей %s: %s", sorted(dropped), cur.rowcount)
+        return cur.rowcount
+
+    def save_to_database(self, vacancies: Iterable[Vacancy] | None = None, company: Dict | None = None,
+                         close_missing: bool = True, area: int | None = None,
+                         dataset: str | None = None) -> Dict[str, int]:
+        """Сохранение данных полученных с hh.ru API в БД в требуемой архитектуре. Работодатели сопоставляются
+        один раз в памяти, вакансии порциями преобразуются в pandas (повторы, перевод зарплат в рубли,
+        см. transform_vacancies), загружаются через COPY во временную таблицу и сливаются с vacancies
+        одной транзакцией: новые добавляются, изменившиеся (по хэшу содержимого) обновляются, а при
+        close_missing=True вакансии загруженных работодателей в том же регионе поиска, которых нет в данных,
+        а также вакансии работодателей, исключённых со времени предыдущей загрузки набора данных dataset
+        (по умолчанию - имя файла данных), помечаются закрытыми. Вакансии хранятся в секциях по региону
+        поиска (параметр area запроса к hh.ru, а не город вакансии), секция создаётся перед загрузкой;
+        при SNAPSHOTS_ENABLED загруженные вакансии сохраняются в снимок за текущий день.
+        vacancies, company, area - источник вакансий (любой итерируемый, читается по мере загрузки), словарь
+        работодателей и регион поиска, по умолчанию - из файла данных.
+        При загрузке всего файла данных (vacancies=None) вместе с данными сохраняется отпечаток файла,
+        см. is_loaded.
+        Возвращает количество загруженных, добавленных, обновлённых, закрытых вакансий и строк снимка"""
+        if vacancies is None:  # файл мог быть перезаписан после создания объекта
+            self.metadata = read_json_metadata(self.file_path, self.file_name) or self.metadata
+            self.fingerprint = dataset_fingerprint(self.metadata)
+            self.area = self.metadata.get("_metadata", {}).get("area", self.area)
+        record = vacancies is None and bool(self.fingerprint)
+        vacancies = self if vacancies is None else vacancies
+        company = self.company if company is None else company
+        area = int(self.area if area is None else area)
+        snapshot_date = date.today() if SNAPSHOTS_ENABLED else None
+        started = time.perf_counter()
+        rates = load_currency_rates()
+        try:
+            # Работодатели фиксируются отдельной короткой транзакцией: создание секции vacancies блокирует
+            # employers (внешний ключ), и параллельные загрузки не должны ждать друг друга по строкам employers
+            with self._transaction() as cur:
+                employers = self._save_employers(cur, company)
+            self._ensure_partitions(area, snapshot_date)
+            with self._transaction() as cur:
                 cur.execute("""
-                    CREATE TABLE vacancies (
-                        vacancy_id SERIAL PRIMARY KEY,
-                        employer_id INTEGER REFERENCES employers(employer_id),
-                        title VARCHAR(255) NOT NULL,
+                    CREATE TEMP TABLE vacancies_stage (
+                        hh_vacancy_id BIGINT,
+                        employer_id INTEGER,
+                        title VARCHAR(255),
                         salary_from INTEGER,
                         salary_to INTEGER,
+                        salary_mid INTEGER,
                         currency VARCHAR(10),
-                        url VARCHAR(512) UNIQUE,
-                        CONSTRAINT fk_employer FOREIGN KEY(employer_id) REFERENCES employers(employer_id));
+                        url VARCHAR(512)
+                    ) ON COMMIT DROP;
+                    CREATE TEMP TABLE vacancies_unconverted (hh_vacancy_id BIGINT) ON COMMIT DROP;
                 """)
-                logger.info("Таблицы employers и vacancies созданы")
-            except psycopg2.Error as er:
-                logger.error(f"Ошибка создания таблиц: {er}")
-                raise
+                staged = unconverted = 0
+                for batch in batched(vacancies, DB_COPY_BATCH_SIZE):
+                    with metrics.timer("db_load_batch_seconds", phase="transform"):
+                        raw = vacancies_frame(batch)
+                        skipped = unconverted_ids(raw, rates).to_frame()
+                        frame = transform_vacancies(raw, rates)
+                        frame["employer_id"] = frame["employer_id"].map(employers).astype("Int64")
+                    with metrics.timer("db_load_batch_seconds", phase="copy"):
+                        staged += self._copy_frame(cur, "vacancies_stage", frame[FRAME_COLUMNS])
+                        unconverted += self._copy_frame(cur, "vacancies_unconverted", skipped)
+                if unconverted:
+                    logger.warning("Вакансий в валютах без курса: %s, они не загружены и не закрываются", unconverted)
+                upsert_started = time.perf_counter()
+                # Системный столбец xmax в RETURNING секционированной таблицы недоступен: добавленная строка
+                # отличается временем first_seen_at, равным времени начала текущей транзакции
+                cur.execute("""
+                    INSERT INTO vacancies (area_id, hh_vacancy_id, employer_id, title, salary_from, salary_to,
+                                           currency, url, content_hash)
+                    SELECT DISTINCT ON (hh_vacancy_id)
+                           %s, hh_vacancy_id, employer_id, title, salary_from, salary_to, currency, url,
+                           md5(concat_ws('|', employer_id, title, salary_from, salary_to, currency, url))
+                    FROM vacancies_stage
+                    ORDER BY hh_vacancy_id
+                    ON CONFLICT (area_id, hh_vacancy_id) DO UPDATE SET
+                        employer_id = EXCLUDED.employer_id,
+                        title = EXCLUDED.title,
+                        salary_from = EXCLUDED.salary_from,
+                        salary_to = EXCLUDED.salary_to,
+                        currency = EXCLUDED.currency,
+                        url = EXCLUDED.url,
+                        content_hash = EXCLUDED.content_hash,
+                        updated_at = now(),
+                        closed_at = NULL
+                    WHERE vacancies.content_hash IS DISTINCT FROM EXCLUDED.content_hash
+                       OR vacancies.closed_at IS NOT NULL
+                    RETURNING (first_seen_at = now()) AS inserted
+                """, (area,))
+                changes = [row[0] for row in cur.fetchall()]
+                if area != UNKNOWN_AREA:
+                    # Вакансии загруженных работодателей, перенесённые миграцией без региона, заменяются
+                    # загруженными с регионом, в том числе снятые с hh.ru - иначе они остались бы открытыми
+                    cur.execute("""
+                        DELETE FROM vacancies v
+                        WHERE v.area_id = %s AND v.employer_id = ANY(%s)
+                    """, (UNKNOWN_AREA, list(employers.values())))
+                metrics.observe("phase_seconds", time.perf_counter() - upsert_started, phase="db_upsert")
+                closed = 0
+                if close_missing:
+                    # Только секция региона поиска: вакансии, загруженные по другим регионам, не затрагиваются.
+                    # Вакансии, отброшенные из-за отсутствия курса валюты (например, справочник hh.ru недоступен),
+                    # есть на hh.ru и тоже остаются открытыми
+                    cur.execute("""
+                        UPDATE vacancies v SET closed_at = now()
+                        WHERE v.closed_at IS NULL
+                          AND v.area_id = %s
+                          AND v.employer_id = ANY(%s)
+                          AND NOT EXISTS (SELECT 1 FROM vacancies_stage s WHERE s.hh_vacancy_id = v.hh_vacancy_id)
+                          AND NOT EXISTS (SELECT 1 FROM vacancies_unconverted u
+                                          WHERE u.hh_vacancy_id = v.hh_vacancy_id)
+                    """, (area, list(employers.values())))
+                    closed = cur.rowcount + self._close_dropped_employers(cur, dataset or self.file_name, company,
+                                                                          area)
+                snapshot = self._save_snapshot(cur, area, snapshot_date) if snapshot_date and staged else 0
+                if record:
+                    self._record_dataset(cur, self.fingerprint, self.metadata, self.metadata.get("records"), dataset)
+        except psycopg2.Error as er:
+            logger.error("Ошибка сохранения данных: %s", er)
+            raise
+        self.refresh_salary_stats()
+        if SNAPSHOTS_ENABLED:
+            self.drop_old_snapshots()
+        self._bump_data_version()
+        elapsed = time.perf_counter() - started
+        stats = {"loaded": staged, "inserted": sum(changes), "updated": len(changes) - sum(changes), "closed": closed,
+                 "snapshot": snapshot}
+        rows_per_second = staged / elapsed if elapsed else 0
+        metrics.observe("phase_seconds", elapsed, phase="db_load")
+        for operation, rows in stats.items():
+            metrics.inc("db_rows_total", rows, operation=operation)
+        metrics.set("db_load_rows_per_second", round(rows_per_second, 1))
+        logger.info("Данные сохранены в БД: %s, %.0f строк/с", stats, rows_per_second)
+        return stats
 
-    def save_to_database(self):
-        """Сохранение данных полученных с hh.ru API в БД в требуемой архитектуре"""
-        with (self.conn.cursor() as cur):
-            try:
-                # Вставка работодателей
-                for company_name, hh_id in self.company.items():
-                    cur.execute(
-                        "INSERT INTO employers (hh_id, name) VALUES (%s, %s) ON CONFLICT (hh_id) DO NOTHING",
-                        (hh_id, company_name)
-                    )
-                # Вставка вакансий
-                for vacancy in self.all_vacancies:
-                    salary = vacancy.get('salary', {})
-                    if not salary or vacancy.get('salary', {}).get('currency') != 'RUR':
-                        continue
-                    cur.execute(
-                        """
-                        INSERT INTO vacancies (employer_id, title, salary_from, salary_to, currency, url)
-                        VALUES (
-                            (SELECT employer_id FROM employers WHERE hh_id = %s),
-                            %s, %s, %s, %s, %s
-                        ) ON CONFLICT (url) DO NOTHING
-                        """,
-                        (
-                            vacancy['employer']['id'],
-                            vacancy['name'],
-                            salary.get('from'),
-                            salary.get('to'),
-                            salary.get('currency'),
-                            vacancy['alternate_url']
-                        )
-                    )
-                logger.info(f"Данные сохранены в БД, вакансий: {len(list(self.all_vacancies))}")
-            except psycopg2.Error as er:
-                logger.error(f"Ошибка сохранения данных: {er}")
-                raise
+    def refresh_salary_stats(self) -> None:
+        """Пересчёт материализованной статистики зарплат без блокировки читающих запросов"""
+        with metrics.timer("phase_seconds", phase="refresh_salary_stats"), self._connection() as conn, \
+                conn.cursor() as cur:
+            cur.execute("REFRESH MATERIALIZED VIEW CONCURRENTLY salary_stats;")
+        logger.info("Статистика зарплат обновлена")
 
-    def get_companies_and_vacancies_count(self):
-        """Получает список всех компаний и количество вакансий у каждой компании"""
-        query = """
+    @staticmethod
+    def _area_filter(area: int | None, history: bool = False) -> tuple:
+        """Условие на регион вакансий v и его параметры. Условие по ключу секционирования позволяет
+        планировщику читать только секцию региона. area=None - все регионы: вакансия, найденная по пересекающимся
+        регионам (Россия и Москва), учитывается один раз - по строке с наименьшим area_id.
+        history=True - v это снимки vacancy_snapshots, повторы исключаются в пределах дня снимка"""
+        if area is not None:
+            return "AND v.area_id = %s", [area]
+        if history:
+            same = "vacancy_snapshots d WHERE d.snapshot_date = v.snapshot_date"
+        else:
+            same = "vacancies d WHERE d.closed_at IS NULL"
+        return (f"AND NOT EXISTS (SELECT 1 FROM {same} AND d.hh_vacancy_id = v.hh_vacancy_id "
+                f"AND d.area_id < v.area_id)", [])
+
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_companies_and_vacancies_count(self, area: int | None = None):
+        """Получает список всех компаний и количество вакансий у каждой компании (area - только в регионе)"""
+        condition, params = self._area_filter(area)
+        query = f"""
             SELECT e.name, COUNT(v.vacancy_id) as vacancies_count
             FROM employers e
-            LEFT JOIN vacancies v ON e.employer_id = v.employer_id
+            LEFT JOIN vacancies v ON e.employer_id = v.employer_id AND v.closed_at IS NULL {condition}
             GROUP BY e.name
             ORDER BY vacancies_count DESC
         """
-        return self._execute_query(query)
+        return self._execute_query(query, params)
 
-    def get_all_vacancies(self):
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_all_vacancies(self, area: int | None = None):
         """Получает список всех вакансий с указанием названия компании, названия вакансии, зарплаты(от - до)
-        и ссылки на вакансию"""
-        query = """
+        и ссылки на вакансию (area - только в регионе)"""
+        return list(self.iter_all_vacancies(area=area))
+
+    @metrics.timed("db_query_seconds")
+    def iter_all_vacancies(self, batch_size: int = DB_FETCH_BATCH_SIZE, area: int | None = None) -> Iterator[Dict]:
+        """То же, что get_all_vacancies, но вакансии отдаются лениво по мере чтения из БД"""
+        condition, params = self._area_filter(area)
+        query = f"""
             SELECT e.name as company, v.title, 
                     v.salary_from, v.salary_to, v.currency, v.url
             FROM vacancies v
             JOIN employers e ON v.employer_id = e.employer_id
-            ORDER BY e.name, (v.salary_from + v.salary_to)/2 DESC
+            WHERE v.closed_at IS NULL {condition}
+            ORDER BY e.name, v.salary_mid DESC NULLS LAST
         """
-        return self._execute_query(query)
+        return self._stream_query(query, params, batch_size=batch_size)
 
-    def get_avg_salary(self):
-        """Получает среднюю зарплату по вакансиям имеющим значения зарплаты 'от' и 'до', остальные игнорируются"""
-        with self.conn.cursor() as cur:
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_avg_salary(self, area: int | None = None):
+        """Получает среднюю зарплату по вакансиям (area - только в регионе). Для вакансий с одной границей
+        вилки берётся эта граница, вакансии без зарплаты игнорируются. Значение берётся из материализованной
+        статистики salary_stats"""
+        with self._connection() as conn, conn.cursor() as cur:
             try:
-                cur.execute("""
-                    SELECT AVG((salary_from + salary_to)/2) as avg_salary
-                    FROM vacancies
-                    WHERE salary_from IS NOT NULL AND salary_to IS NOT NULL
-                """)
-                return round(cur.fetchone()[0] or 0, 2)
+                cur.execute("SELECT avg_salary FROM salary_stats WHERE area_id = %s AND employer_id = 0",
+                            (area or 0,))
+                row = cur.fetchone()
+                return round(row[0] or 0, 2) if row else 0.0
             except psycopg2.Error as er:
-                logger.error(f"Ошибка расчета средней зарплаты: {er}")
+                logger.error("Ошибка расчета средней зарплаты: %s", er)
                 return 0.0
 
-    def get_vacancies_with_higher_salary(self):
-        """Получает список всех вакансий, у которых зарплата выше средней по всем вакансиям"""
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_salary_stats(self, area: int | None = None) -> List[Dict]:
+        """Получает статистику зарплат по компаниям: количество вакансий с зарплатой, среднюю, медиану
+        и 90-й перцентиль (area - только в регионе). Строка с company = None - статистика по всем вакансиям"""
         query = """
+            SELECT e.name as company, s.vacancies_count, s.avg_salary, s.median_salary, s.p90_salary
+            FROM salary_stats s
+            LEFT JOIN employers e ON s.employer_id = e.employer_id
+            WHERE s.area_id = %s
+            ORDER BY s.employer_id = 0 DESC, s.avg_salary DESC
+        """
+        return self._execute_query(query, [area or 0])
+
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_vacancies_with_higher_salary(self, area: int | None = None):
+        """Получает список всех вакансий, у которых зарплата выше средней по всем вакансиям
+        (area - вакансии региона с зарплатой выше средней по региону)"""
+        condition, params = self._area_filter(area)
+        query = f"""
             SELECT e.name as company, v.title, 
                     v.salary_from, v.salary_to, v.currency, v.url
             FROM vacancies v
             JOIN employers e ON v.employer_id = e.employer_id
-            WHERE (v.salary_from + v.salary_to)/2 > (
-                SELECT AVG((salary_from + salary_to)/2) 
-                FROM vacancies
-                WHERE salary_from IS NOT NULL AND salary_to IS NOT NULL
+            WHERE v.closed_at IS NULL {condition} AND v.salary_mid > (
+                SELECT avg_salary FROM salary_stats WHERE area_id = %s AND employer_id = 0
             )
-            ORDER BY (v.salary_from + v.salary_to)/2 DESC
+            ORDER BY v.salary_mid DESC NULLS LAST
         """
-        return self._execute_query(query)
+        return self._execute_query(query, params + [area or 0])
 
-    def get_vacancies_with_keyword(self, keyword: str) -> List[Dict]:
-        """Получает список всех вакансий, в названии которых содержатся переданные в метод слова"""
-        query = """
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_salary_history(self, days: int = 30, area: int | None = None) -> List[Dict]:
+        """История зарплат по снимкам за последние days дней: по каждому дню и компании количество вакансий
+        с зарплатой, средняя и медиана (area - только в регионе). Читаются только секции снимков за период"""
+        condition, params = self._area_filter(area, history=True)
+        query = f"""
+            SELECT v.snapshot_date, e.name as company, COUNT(*) as vacancies_count,
+                   AVG(v.salary_mid) as avg_salary,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY v.salary_mid) as median_salary
+            FROM vacancy_snapshots v
+            JOIN employers e ON v.employer_id = e.employer_id
+            WHERE v.snapshot_date > CURRENT_DATE - %s {condition} AND v.salary_mid IS NOT NULL
+            GROUP BY v.snapshot_date, e.name
+            ORDER BY v.snapshot_date, e.name
+        """
+        return self._execute_query(query, [days] + params)
+
+    def _has_trigram_index(self) -> bool:
+        """Есть ли триграммный индекс по названию вакансии (без расширения pg_trgm он не создаётся).
+        Проверяется один раз после подключения к БД или миграции схемы"""
+        if self._trigram_index is None:
+            rows = self._execute_query("SELECT to_regclass('vacancies_title_trgm_idx') IS NOT NULL AS found")
+            self._trigram_index = bool(rows and rows[0]["found"])
+        return self._trigram_index
+
+    @staticmethod
+    def _search_query(text: str, mode: str, limit: int | None, offset: int, area: int | None = None,
+                      trigram: bool = True) -> tuple:
+        """SQL и параметры поиска: слова запроса (с учётом морфологии и как префиксы) по индексу tsvector
+        либо вхождение всей строки по триграммному индексу. Результаты ранжируются по релевантности.
+        trigram=False - триграммного индекса нет: вхождение строки проверяется, только если в запросе
+        нет слов, иначе условие ILIKE в OR заставило бы читать таблицу целиком"""
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска {mode}, допустимые: {', '.join(SEARCH_MODES)}")
+        terms = re.findall(r"\w+", text)
+        ts_query = SEARCH_MODES[mode].join(f"{term}:*" for term in terms)
+        pattern = text.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        condition, params = DBManager._area_filter(area)
+        if terms and trigram:
+            match, match_params = "(v.title_tsv @@ q OR v.title ILIKE %s)", [f"%{pattern}%"]
+        elif terms:
+            match, match_params = "v.title_tsv @@ q", []
+        else:
+            match, match_params = "v.title ILIKE %s", [f"%{pattern}%"]
+        query = f"""
             SELECT e.name as company, v.title, 
-                    v.salary_from, v.salary_to, v.currency, v.url
+                    v.salary_from, v.salary_to, v.currency, v.url,
+                    ts_rank(v.title_tsv, q) as rank
             FROM vacancies v
-            JOIN employers e ON v.employer_id = e.employer_id
-            WHERE v.title ILIKE %s
-            ORDER BY (v.salary_from + v.salary_to)/2 DESC
+            JOIN employers e ON v.employer_id = e.employer_id,
+                 to_tsquery('russian', %s) q
+            WHERE v.closed_at IS NULL {condition} AND {match}
+            ORDER BY rank DESC, v.salary_mid DESC NULLS LAST
+            LIMIT %s OFFSET %s
         """
-        return self._execute_query(query, [f"%{keyword}%"])
+        return query, [ts_query] + params + match_params + [limit, offset]
+
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def search_vacancies(self, text: str, mode: str = "and", limit: int | None = None,
+                         offset: int = 0, area: int | None = None) -> List[Dict]:
+        """Поиск вакансий по словам в названии.
+        mode - "and": все слова, "or": любое из слов, "phrase": слова подряд в заданном порядке;
+        limit, offset - постраничный вывод результатов, limit=None - без ограничения; area - только в регионе"""
+        if not text or not text.strip():
+            return []
+        return self._execute_query(*self._search_query(text, mode, limit, offset, area, self._has_trigram_index()))
+
+    @cached_query
+    @metrics.timed("db_query_seconds")
+    def get_vacancies_with_keyword(self, keyword: str, area: int | None = None) -> List[Dict]:
+        """Получает список всех вакансий, в названии которых содержатся переданные в метод слова
+        (area - только в регионе)"""
+        return list(self.iter_vacancies_with_keyword(keyword, area=area))
+
+    @metrics.timed("db_query_seconds")
+    def iter_vacancies_with_keyword(self, keyword: str, batch_size: int = DB_FETCH_BATCH_SIZE,
+                                    mode: str = "and", area: int | None = None) -> Iterator[Dict]:
+        """То же, что get_vacancies_with_keyword, но вакансии отдаются лениво по мере чтения из БД"""
+        if not keyword or not keyword.strip():
+            return iter([])
+        return self._stream_query(*self._search_query(keyword, mode, None, 0, area, self._has_trigram_index()),
+                                  batch_size)
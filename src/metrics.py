@@ -0,0 +1,221 @@
+import functools
+import inspect
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+from src.config import METRICS_ENABLED, METRICS_PREFIX
+
+# Границы корзин гистограмм времени выполнения, сек
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_Key = Tuple[str, Tuple[Tuple[str, str], ...]]
+
+
+def _number(value: float) -> str:
+    """Запись числа без потери точности: целые - без дробной части"""
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Histogram:
+    """Распределение значений по корзинам с суммой, количеством, минимумом и максимумом"""
+
+    __slots__ = ("buckets", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def cumulative(self) -> Iterator[Tuple[str, int]]:
+        """Накопленное количество значений не больше границы корзины, последняя корзина - +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield f"{bound:g}", total
+        yield "+Inf", self.count
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "min": round(self.min, 6) if self.count else 0.0,
+            "max": round(self.max, 6) if self.count else 0.0,
+            "buckets": dict(self.cumulative()),
+        }
+
+
+class Metrics:
+    """Потокобезопасный реестр метрик процесса: счётчики (inc), текущие значения (set) и гистограммы
+    времени выполнения (observe, timer, timed). Метрика определяется именем и набором меток, например
+    metrics.inc("http_requests_total", status=200). В конце запуска метрики выгружаются в JSON
+    или в текстовом формате Prometheus (export). enabled=False - все вызовы ничего не делают"""
+
+    def __init__(self, prefix: str = METRICS_PREFIX, enabled: bool = METRICS_ENABLED,
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.prefix = prefix
+        self.enabled = enabled
+        self.buckets = buckets
+        self._counters: Dict[_Key, float] = {}
+        self._gauges: Dict[_Key, float] = {}
+        self._histograms: Dict[_Key, _Histogram] = {}
+        self._lock = threading.Lock()
+        self._started = time.time()
+
+    def __repr__(self):
+        return (f"Metrics(counters={len(self._counters)}, gauges={len(self._gauges)}, "
+                f"histograms={len(self._histograms)})")
+
+    @staticmethod
+    def _key(name: str, labels: Dict[str, Any]) -> _Key:
+        return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Увеличение счётчика"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Установка текущего значения (например, скорости загрузки строк в секунду)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Добавление значения в гистограмму"""
+        if not self.enabled:
+            return
+        key = self._key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(self.buckets)
+            histogram.observe(value)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Iterator[None]:
+        """Замер времени выполнения блока with в гистограмму name, сек"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels) -> Callable:
+        """Декоратор замера времени выполнения функции, метка query - имя функции. Если функция возвращает
+        генератор, замеряется время до его исчерпания или закрытия"""
+
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                result = func(*args, **kwargs)
+                if inspect.isgenerator(result):
+                    return self._timed_generator(result, started, name, {"query": func.__name__, **labels})
+                self.observe(name, time.perf_counter() - started, query=func.__name__, **labels)
+                return result
+
+            return wrapper
+
+        return decorator
+
+    def _timed_generator(self, generator: Iterator, started: float, name: str, labels: Dict) -> Iterator:
+        try:
+            yield from generator
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+            self._started = time.time()
+
+    @staticmethod
+    def _label_text(labels: Tuple[Tuple[str, str], ...], extra: str = "") -> str:
+        parts = [f'{label}="{value}"' for label, value in labels]
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Все метрики словарём: ключ - имя с метками в записи Prometheus"""
+        with self._lock:
+            return {
+                "uptime_seconds": round(time.time() - self._started, 3),
+                "counters": {f"{name}{self._label_text(labels)}": value
+                             for (name, labels), value in sorted(self._counters.items())},
+                "gauges": {f"{name}{self._label_text(labels)}": value
+                           for (name, labels), value in sorted(self._gauges.items())},
+                "histograms": {f"{name}{self._label_text(labels)}": histogram.to_dict()
+                               for (name, labels), histogram in sorted(self._histograms.items())},
+            }
+
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=4)
+
+    def to_prometheus(self) -> str:
+        """Метрики в текстовом формате Prometheus (exposition format 0.0.4)"""
+        lines = []
+        with self._lock:
+            for kind, items in (("counter", self._counters), ("gauge", self._gauges)):
+                typed = set()
+                for (name, labels), value in sorted(items.items()):
+                    full_name = f"{self.prefix}{name}"
+                    if full_name not in typed:
+                        lines.append(f"# TYPE {full_name} {kind}")
+                        typed.add(full_name)
+                    lines.append(f"{full_name}{self._label_text(labels)} {_number(value)}")
+            typed = set()
+            for (name, labels), histogram in sorted(self._histograms.items()):
+                full_name = f"{self.prefix}{name}"
+                if full_name not in typed:
+                    lines.append(f"# TYPE {full_name} histogram")
+                    typed.add(full_name)
+                for bound, count in histogram.cumulative():
+                    le = f'le="{bound}"'
+                    lines.append(f"{full_name}_bucket{self._label_text(labels, le)} {count}")
+                lines.append(f"{full_name}_sum{self._label_text(labels)} {_number(histogram.sum)}")
+                lines.append(f"{full_name}_count{self._label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, file: Path, fmt: str = "json") -> Path:
+        """Выгрузка метрик в файл: fmt - json или prometheus. Метрики пишутся во временный файл рядом,
+        который затем атомарно подменяет file, - читатель файла не увидит его недописанным"""
+        if fmt not in ("json", "prometheus"):
+            raise ValueError(f"Неизвестный формат метрик {fmt}, допустимые: json, prometheus")
+        file = Path(file)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=file.parent, prefix=f".{file.name}.",
+                                         delete=False) as f:
+            f.write(self.to_json() if fmt == "json" else self.to_prometheus())
+        os.replace(f.name, file)
+        return file
+
+
+metrics = Metrics()  # Общий реестр метрик процесса
@@ -0,0 +1,85 @@
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+from typing import Dict, Iterator
+
+from src.api_client import HHAPIClient
+from src.config import PIPELINE_QUEUE_SIZE, setup_logging
+from src.database_processings import DBManager
+from src.metrics import metrics
+from src.utils import JsonCacheWriter
+
+modul_name = os.path.basename(__file__)
+logger = setup_logging(modul_name)
+
+_DONE = object()  # Признак окончания сбора в очереди страниц
+
+
+def run_pipeline(client: HHAPIClient, db_manager: DBManager, tee_to_cache: bool = True,
+                 queue_size: int = PIPELINE_QUEUE_SIZE, close_missing: bool = True) -> Dict[str, int]:
+    """Конвейер «сбор - загрузка в БД»: страницы вакансий, полученные клиентом, через ограниченную очередь
+    сразу уходят в загрузку COPY, поэтому сеть и БД работают одновременно, а в памяти находится не больше
+    queue_size страниц. tee_to_cache=True - вакансии параллельно пишутся в файл данных клиента.
+    При ошибке сбора транзакция загрузки откатывается, а прежний файл данных остаётся нетронутым.
+    После записи файла данных в БД сохраняется его отпечаток, чтобы следующий запуск с этим файлом
+    не загружал те же данные повторно (см. DBManager.is_loaded).
+    Возвращает статистику загрузки save_to_database"""
+    pages = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+    with_salary = 1 if client.salary else 0
+
+    def produce() -> None:
+        try:
+            for items in client.iter_pages(client.company, client.pages, with_salary):
+                while not stop.is_set():
+                    try:
+                        pages.put(items, timeout=0.5)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+        except Exception as err:
+            errors.append(err)
+        finally:
+            pages.put(_DONE)
+
+    employer_ids = [str(v) for v in client.company.values()]
+    state = client.employers_state([], employer_ids)
+
+    def consume(writer: JsonCacheWriter | None) -> Iterator[Dict]:
+        while (items := pages.get()) is not _DONE:
+            for vacancy in items:
+                client.track_published(state, vacancy)
+                if writer is not None:
+                    writer.write(vacancy)
+                yield vacancy
+        if errors:
+            raise errors[0]
+
+    started = time.perf_counter()
+    producer = threading.Thread(target=produce, name="hh-fetch", daemon=True)
+    producer.start()
+    cache = JsonCacheWriter(client.file_path, client.file_name) if tee_to_cache else nullcontext()
+    try:
+        with cache as writer:
+            stats = db_manager.save_to_database(consume(writer), client.company, close_missing, client.area,
+                                                client.file_name)
+            if writer is not None:
+                writer.metadata = client.cache_metadata(client.company, client.area, client.salary, state)
+        if writer is not None:
+            db_manager.record_dataset(writer.fingerprint, writer.metadata, writer.records, client.file_name)
+    finally:
+        stop.set()
+        while producer.is_alive():  # освобождаем место в очереди, если загрузка прервалась
+            try:
+                pages.get_nowait()
+            except queue.Empty:
+                producer.join(0.1)
+    elapsed = time.perf_counter() - started
+    metrics.observe("phase_seconds", elapsed, phase="pipeline")
+    logger.info("Конвейер завершён за %.1f с: %s", elapsed, stats)
+    return stats
@@ -0,0 +1,77 @@
+import functools
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from src.config import QUERY_CACHE_SIZE, QUERY_CACHE_TTL_SECONDS
+from src.metrics import metrics
+
+
+class QueryCache:
+    """Потокобезопасный кэш результатов запросов в памяти процесса с вытеснением давно не использованных
+    записей (LRU) и ограниченным временем жизни записи (TTL). maxsize - максимум записей, ttl - секунды"""
+
+    def __init__(self, maxsize: int = QUERY_CACHE_SIZE, ttl: float = QUERY_CACHE_TTL_SECONDS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[Hashable, Tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f"QueryCache(maxsize={self.maxsize}, ttl={self.ttl}, {self.stats()})"
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Возвращает (True, значение) при попадании в кэш и (False, None) при промахе"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and time.monotonic() - item[0] < self.ttl:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, item[1]
+            if item is not None:
+                del self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов и текущий размер кэша"""
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+
+def cached_query(method: Callable) -> Callable:
+    """Декоратор метода DBManager: результат кэшируется в self.query_cache по имени метода, аргументам
+    и версии набора данных self.data_version. Возвращаемый из кэша результат общий для всех вызовов,
+    изменять его нельзя"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        cache = self.query_cache
+        if cache is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, args, tuple(sorted(kwargs.items())), self.data_version)
+        found, value = cache.get(key)
+        metrics.inc("db_query_cache_total", result="hit" if found else "miss")
+        if found:
+            return value
+        value = method(self, *args, **kwargs)
+        cache.set(key, value)
+        return value
+
+    return wrapper
@@ -0,0 +1,52 @@
+import threading
+import time
+
+from src.config import HH_API_RATE_BURST, HH_API_RATE_LIMIT
+
+
+class TokenBucket:
+    """Потокобезопасный ограничитель частоты запросов по алгоритму «корзины токенов».
+    rate - скорость пополнения корзины, токенов в секунду;
+    capacity - ёмкость корзины (сколько запросов можно выполнить «залпом»).
+    Один экземпляр может разделяться между несколькими клиентами, тогда лимит действует на всех сразу"""
+
+    def __init__(self, rate: float = HH_API_RATE_LIMIT, capacity: int = HH_API_RATE_BURST):
+        if rate <= 0:
+            raise ValueError("Частота запросов должна быть больше нуля")
+        self.rate = float(rate)
+        self.capacity = max(1, int(capacity))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"TokenBucket(rate={self.rate}, capacity={self.capacity})"
+
+    def _refill(self, now: float) -> None:
+        """Пополнение корзины пропорционально прошедшему времени"""
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Забирает токены из корзины, при их нехватке блокирует поток до пополнения.
+        Возвращает суммарное время ожидания в секундах"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                pause = self._blocked_until - now
+                if pause <= 0 and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                if pause <= 0:
+                    pause = (tokens - self._tokens) / self.rate
+            time.sleep(pause)
+            waited += pause
+
+    def block_for(self, seconds: float) -> None:
+        """Приостанавливает выдачу токенов всем потокам (например, по заголовку Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from src.config import RESPONSE_CACHE_DIR, RESPONSE_CACHE_MAX_MB, RESPONSE_CACHE_TTL_HOURS, setup_logging
+from src.metrics import metrics
+
+modul_name = os.path.basename(__file__)
+logger = setup_logging(modul_name)
+
+
+class ResponseCache:
+    """Дисковый кэш ответов API hh.ru: один файл на запрос, ключ - параметры запроса
+    (работодатель, регион, страница, только с зарплатой, валюта, ...). Запись устаревает через ttl секунд.
+    При превышении max_bytes удаляются записи, к которым дольше всего не обращались (LRU по времени доступа)"""
+
+    def __init__(self, cache_dir: Path = RESPONSE_CACHE_DIR, ttl: float = RESPONSE_CACHE_TTL_HOURS * 3600,
+                 max_bytes: int = RESPONSE_CACHE_MAX_MB * 1024 * 1024):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._size = sum(f.stat().st_size for f in self.cache_dir.glob("*.json"))
+
+    def __repr__(self):
+        return f"ResponseCache({self.cache_dir}, ttl={self.ttl}, max_bytes={self.max_bytes}, {self.stats()})"
+
+    @staticmethod
+    def key(params: Dict[str, Any]) -> str:
+        """Ключ записи - хэш параметров запроса, не зависящий от порядка параметров"""
+        raw = json.dumps({k: str(v) for k, v in params.items()}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, params: Dict[str, Any]) -> Path:
+        return self.cache_dir / f"{self.key(params)}.json"
+
+    def get(self, params: Dict[str, Any]) -> Optional[Dict]:
+        """Ответ из кэша или None, если записи нет или она устарела"""
+        path = self._path(params)
+        try:
+            stat = path.stat()
+            if time.time() - stat.st_mtime >= self.ttl:
+                raise FileNotFoundError
+            with open(path, "r", encoding="utf-8") as f:
+                response = json.load(f)
+            os.utime(path, (time.time(), stat.st_mtime))  # время доступа - порядок вытеснения
+        except (FileNotFoundError, json.JSONDecodeError, ValueError):
+            with self._lock:
+                self.misses += 1
+            metrics.inc("response_cache_total", result="miss")
+            return None
+        with self._lock:
+            self.hits += 1
+        metrics.inc("response_cache_total", result="hit")
+        return response
+
+    def set(self, params: Dict[str, Any], response: Dict) -> None:
+        """Сохранение ответа: запись во временный файл и атомарная подмена"""
+        path = self._path(params)
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.cache_dir, prefix=".", suffix=".tmp",
+                                         delete=False) as f:
+            json.dump(response, f, ensure_ascii=False, separators=(",", ":"))
+        size = os.path.getsize(f.name)
+        with self._lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(f.name, path)
+            self._size += size - old_size
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self) -> None:
+        """Удаление устаревших записей, затем давно не использованных, пока кэш не уменьшится до 90% лимита"""
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            expired = now - stat.st_mtime >= self.ttl
+            entries.append((not expired, stat.st_atime, stat.st_size, path))
+        entries.sort()
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, _, size, path in entries:
+            if self._size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+            removed += 1
+        metrics.inc("response_cache_evicted_total", removed)
+        logger.info("Из кэша ответов удалено записей: %s, размер %s байт", removed, self._size)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in self.cache_dir.glob("*.json"):
+                path.unlink(missing_ok=True)
+            self._size = 0
+
+    def stats(self) -> Dict[str, int]:
+        """Счётчики попаданий и промахов и текущий размер кэша в байтах"""
+        return {"hits": self.hits, "misses": self.misses, "bytes": self._size}
@@ -0,0 +1,95 @@
+import json
+import os
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List
+
+import pandas as pd
+import requests
+
+from src.config import CURRENCY_RATES_FILE, CURRENCY_RATES_TTL_HOURS, CURRENCY_RATES_URL, DEFAULT_CURRENCY, \
+    HH_API_HEADERS, HH_API_TIMEOUT, setup_logging
+from src.utils import is_expired, write_json_atomic
+from src.vacancy import Vacancy
+
+modul_name = os.path.basename(__file__)
+logger = setup_logging(modul_name)
+
+# Колонки таблицы вакансий после преобразования, в порядке загрузки во временную таблицу БД
+FRAME_COLUMNS = ["hh_vacancy_id", "employer_id", "title", "salary_from", "salary_to", "salary_mid", "currency", "url"]
+# Курсы при недоступном справочнике hh.ru и отсутствии файла курсов
+FALLBACK_RATES = {DEFAULT_CURRENCY: 1.0}
+
+
+def load_currency_rates(rates_file: Path = CURRENCY_RATES_FILE,
+                        ttl_hours: float = CURRENCY_RATES_TTL_HOURS) -> Dict[str, float]:
+    """Курсы валют из справочника hh.ru: {код: сколько единиц валюты в одном рубле}. Справочник кэшируется
+    в локальном файле и запрашивается заново раз в ttl_hours. Если hh.ru недоступен - используется
+    устаревший файл, а при его отсутствии только рубль (вакансии в других валютах будут отброшены)"""
+    cached = None
+    if rates_file.exists():
+        try:
+            with open(rates_file, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+        except (json.JSONDecodeError, ValueError):
+            logger.warning("Ошибка чтения файла курсов %s", rates_file)
+    if cached and not is_expired(datetime.fromtimestamp(rates_file.stat().st_mtime), ttl_hours):
+        return cached
+    try:
+        response = requests.get(CURRENCY_RATES_URL, headers=HH_API_HEADERS, timeout=HH_API_TIMEOUT)
+        response.raise_for_status()
+        rates = {item["code"]: float(item["rate"]) for item in response.json().get("currency", []) if item.get("rate")}
+    except (requests.exceptions.RequestException, ValueError, KeyError) as err:
+        logger.warning("Не удалось получить курсы валют: %s", err)
+        return cached or dict(FALLBACK_RATES)
+    write_json_atomic(rates, rates_file)
+    logger.info("Курсы валют обновлены: %s валют", len(rates))
+    return rates
+
+
+def batched(vacancies: Iterable[Vacancy], size: int) -> Iterator[List[Vacancy]]:
+    """Разбиение потока вакансий на списки по size штук"""
+    iterator = iter(vacancies)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def vacancies_frame(vacancies: List[Vacancy]) -> pd.DataFrame:
+    """Построение таблицы из записей Vacancy по колонкам"""
+    return pd.DataFrame({
+        "hh_vacancy_id": pd.to_numeric([v.id for v in vacancies], errors="coerce"),
+        "employer_id": pd.to_numeric([v.employer_id for v in vacancies], errors="coerce"),
+        "title": [v.name for v in vacancies],
+        "salary_from": pd.array([v.salary_from for v in vacancies], dtype="Float64"),
+        "salary_to": pd.array([v.salary_to for v in vacancies], dtype="Float64"),
+        "currency": [v.currency for v in vacancies],
+        "url": [v.url for v in vacancies],
+    })
+
+
+def unconverted_ids(frame: pd.DataFrame, rates: Dict[str, float]) -> pd.Series:
+    """id вакансий с зарплатой в валюте без курса в rates: transform_vacancies их отбрасывает,
+    но снятыми с hh.ru они не являются"""
+    has_salary = frame["salary_from"].notna() | frame["salary_to"].notna()
+    skipped = frame["currency"].notna() & ~frame["currency"].isin(list(rates)) & has_salary
+    return frame.loc[skipped, "hh_vacancy_id"].dropna().astype("int64")
+
+
+def transform_vacancies(frame: pd.DataFrame, rates: Dict[str, float]) -> pd.DataFrame:
+    """Векторное преобразование таблицы вакансий: удаление повторов по id, перевод зарплат в рубли
+    по курсам rates (вакансии в валютах без курса и без зарплаты отбрасываются) и расчёт средней точки
+    вилки salary_mid (если указана одна граница - берётся она)"""
+    frame = frame.dropna(subset=["hh_vacancy_id"]).drop_duplicates("hh_vacancy_id", keep="last")
+    rate = frame["currency"].map(rates)
+    frame = frame[rate.notna()].copy()
+    rate = rate[rate.notna()]
+    for column in ("salary_from", "salary_to"):
+        frame[column] = (frame[column] / rate).round().astype("Int64")
+    frame["salary_mid"] = ((frame["salary_from"] + frame["salary_to"]) // 2).fillna(frame["salary_from"]) \
+        .fillna(frame["salary_to"])
+    frame = frame[frame["salary_mid"].notna()].copy()
+    frame["currency"] = DEFAULT_CURRENCY
+    frame["hh_vacancy_id"] = frame["hh_vacancy_id"].astype("int64")
+    frame["employer_id"] = frame["employer_id"].astype("Int64")
+    return frame
@@ -1,60 +1,203 @@
+import hashlib
 import json
 import os
+import tempfile
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 from src.config import CACHE_EXPIRE_HOURS, DATA_DIR, DEFAULT_JSON_FILE, setup_logging
+from src.metrics import metrics
 
 modul_name = os.path.basename(__file__)
 logger = setup_logging(modul_name)
 
 
+def json_data_files(file_path: Path, file_name: str) -> Tuple[Path, Path]:
+    """Пути к файлам кэша: тело с вакансиями (по одной JSON-записи на строку) и файл метаданных рядом с ним"""
+    file_path = Path(file_path)
+    return file_path / f"{file_name}.ndjson", file_path / f"{file_name}.meta.json"
+
+
+def _atomic_replace(tmp_name: str, target: Path) -> None:
+    """Сброс временного файла на диск и атомарная подмена им целевого файла"""
+    with open(tmp_name, "rb+") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_name, target)
+
+
+def write_json_atomic(data: Any, target: Path) -> None:
+    """Запись JSON во временный файл рядом с target и атомарная подмена target"""
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=target.parent, prefix=f".{target.name}.",
+                                     delete=False) as f:
+        json.dump(data, f, ensure_ascii=False, indent=4, default=str)
+    _atomic_replace(f.name, target)
+
+
+class JsonCacheWriter:
+    """Потоковая запись кэша вакансий. Вакансии пишутся по одной во временный файл, при успешном выходе
+    из контекста временный файл атомарно подменяет тело кэша, после чего записывается файл метаданных
+    с хэшем содержимого (content_sha256) и отпечатком набора данных (fingerprint, см. dataset_fingerprint).
+    При ошибке временный файл удаляется, а прежний кэш остаётся нетронутым"""
+
+    def __init__(self, file_path: Path = DATA_DIR, file_name: str = DEFAULT_JSON_FILE,
+                 metadata: Optional[Dict[str, Any]] = None):
+        self.body_file, self.meta_file = json_data_files(file_path, file_name)
+        self.metadata = metadata or {}
+        self.records = 0
+        self.fingerprint = None
+        self._file = None
+        self._hash = hashlib.sha256()
+        self._started = None
+
+    def __enter__(self) -> "JsonCacheWriter":
+        self._started = time.perf_counter()
+        self.body_file.parent.mkdir(parents=True, exist_ok=True)
+        self._file = tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=self.body_file.parent,
+                                                 prefix=f".{self.body_file.name}.", delete=False)
+        return self
+
+    def write(self, vacancy: Any) -> None:
+        """Запись одной вакансии (словаря или записи с методом to_dict) компактной строкой"""
+        data = vacancy.to_dict() if hasattr(vacancy, "to_dict") else vacancy
+        line = json.dumps(data, ensure_ascii=False, separators=(",", ":")) + "\n"
+        self._file.write(line)
+        self._hash.update(line.encode("utf-8"))
+        self.records += 1
+
+    def write_many(self, vacancies: Iterable[Any]) -> None:
+        for vacancy in vacancies:
+            self.write(vacancy)
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._file.close()
+        if exc_type is not None:
+            os.unlink(self._file.name)
+            logger.error("Запись %s прервана, кэш не изменён", self.body_file)
+            return
+        _atomic_replace(self._file.name, self.body_file)
+        meta = {**self.metadata, "records": self.records, "body_size": self.body_file.stat().st_size,
+                "content_sha256": self._hash.hexdigest()}
+        self.fingerprint = meta["fingerprint"] = dataset_fingerprint(meta)
+        write_json_atomic(meta, self.meta_file)
+        metrics.observe("cache_write_seconds", time.perf_counter() - self._started)
+        metrics.inc("cache_write_records_total", self.records)
+        metrics.inc("cache_write_bytes_total", meta["body_size"])
+        logger.info("Данные сохранены в %s, вакансий: %s", self.body_file, self.records)
+
+
+def dataset_fingerprint(meta: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Отпечаток набора данных: хэш содержимого файла вакансий вместе с параметрами запроса (работодатели,
+    регион, признак «только с зарплатой»). None - для файлов прежнего формата без хэша содержимого"""
+    if not meta or not meta.get("content_sha256"):
+        return None
+    params = meta.get("_metadata", {})
+    raw = json.dumps({"content": meta["content_sha256"], "company_id_dict": params.get("company_id_dict"),
+                      "area": params.get("area"), "salary": params.get("salary")}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def is_expired(moment: datetime | None, expire_hours: float = CACHE_EXPIRE_HOURS) -> bool:
+    """Проверка, что с момента moment прошло не меньше expire_hours часов. None считается устаревшим"""
+    if moment is None:
+        return True
+    now = datetime.now(moment.tzinfo) if moment.tzinfo else datetime.now()
+    return (now - moment).total_seconds() / 3600 >= expire_hours
+
+
+def parse_hh_datetime(value: str | None) -> datetime | None:
+    """Разбор даты из ответа hh.ru (2025-08-10T12:34:56+0300) или сохранённой в кэше даты в формате ISO"""
+    if not value:
+        return None
+    for fmt in ("%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%dT%H:%M:%S"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def as_aware(moment: datetime) -> datetime:
+    """Дата с часовым поясом: дата без пояса (кэш прежних версий) считается местным временем"""
+    return moment if moment.tzinfo else moment.astimezone()
+
+
+def read_json_metadata(file_path: Path, file_name: str) -> Optional[Dict[str, Any]]:
+    """Чтение метаданных кэша без чтения самих вакансий. Возвращает None, если кэш отсутствует, повреждён
+    или тело кэша не соответствует метаданным (например, запись была прервана между двумя файлами)"""
+    body_file, meta_file = json_data_files(file_path, file_name)
+    if not meta_file.exists() or not body_file.exists():
+        return None
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (json.JSONDecodeError, ValueError):
+        logger.error("Ошибка чтения файла %s", meta_file)
+        return None
+    if meta.get("body_size") != body_file.stat().st_size:
+        logger.warning("Размер %s не совпадает с метаданными", body_file)
+        return None
+    return meta
+
+
+def cache_matches_params(file_path: Path, file_name: str, area: int, salary: Any) -> bool:
+    """Проверяет, что файл данных существует и получен с теми же регионом и признаком «только с зарплатой»,
+    то есть его можно дополнять обновлением по отдельным работодателям"""
+    meta = read_json_metadata(file_path, file_name)
+    params = (meta or {}).get("_metadata", {})
+    return bool(meta) and [params.get("area"), params.get("salary")] == [area, salary]
+
+
 def check_exist_json_data(file_path: Path | None = None, file_name: str | None = None,
                           current_params: Optional[List[Dict] | Any] = None) -> bool:
     """Проверяет существование файла с данными соответствующих запросу и, если он существует менее часа,
-     возвращает True, в противном случае False"""
-    data_file = file_path / f"{file_name}.json"
-    logger.info(f"Старт проверки существования {data_file}")
+     возвращает True, в противном случае False. Читаются только метаданные кэша"""
+    _, meta_file = json_data_files(file_path, file_name)
+    logger.info("Старт проверки существования %s", meta_file)
 
-    if not data_file.exists() or (
-            datetime.now() - datetime.fromtimestamp(data_file.stat().st_mtime)).seconds / 3600 >= CACHE_EXPIRE_HOURS:
-        logger.info(f"Файл {data_file} отсутствует, либо устарел")
+    if not meta_file.exists() or is_expired(datetime.fromtimestamp(meta_file.stat().st_mtime)):
+        logger.info("Файл %s отсутствует, либо устарел", meta_file)
         return False
-    try:
-        with open(data_file, 'r', encoding='utf-8') as f:
-            content = json.load(f)
-        if not content[0].get("data") or not content[1].get("_metadata"):
-            logger.info("Отсутствуют вакансии или метаданные")
-            return False
-        if current_params:
-            logger.info("Проверка данных на соответствие параметрам запроса")
-            if [content[1].get("_metadata").get("company_id_dict"), content[1].get("_metadata").get("area"),
-                content[1].get("_metadata").get("salary")] != current_params:
-                return False
-    except (json.JSONDecodeError, ValueError):
+    content = read_json_metadata(file_path, file_name)
+    if not content or not content.get("records") or not content.get("_metadata"):
+        logger.info("Отсутствуют вакансии или метаданные")
         return False
-    logger.info(f"Файл {data_file} - JSON-файл с актуальными данными")
+    if current_params:
+        logger.info("Проверка данных на соответствие параметрам запроса")
+        if [content.get("_metadata").get("company_id_dict"), content.get("_metadata").get("area"),
+                content.get("_metadata").get("salary")] != current_params:
+            return False
+    logger.info("Файл %s - файл актуальных данных", meta_file)
     return True
 
 
-def read_json_data(file_path: Path, file_name: str) -> List[Dict[str, Any]]:
-    """Функция чтения json-файла"""
-    data_file = file_path / f"{file_name}.json"
+def iter_json_vacancies(file_path: Path, file_name: str) -> Iterator[Dict[str, Any]]:
+    """Ленивое чтение вакансий из кэша по одной, без загрузки файла в память целиком"""
+    body_file, _ = json_data_files(file_path, file_name)
+    started = time.perf_counter()
+    records = 0
     try:
-        with open(data_file, "r", encoding="utf-8") as f:
-            logger.info(f"Данные из {data_file} успешно загружены")
-            return json.load(f)
+        with open(body_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records += 1
+                    yield json.loads(line)
+        metrics.observe("cache_read_seconds", time.perf_counter() - started)
+        metrics.inc("cache_read_records_total", records)
     except json.JSONDecodeError:
         logger.error("Ошибка чтения файла")
         exit("Ошибка чтения файла данных. Попробуйте запустить программу снова.")
 
 
-def overwriting_json_data(data: Dict[str, Any] | None = None, file_path: Path = DATA_DIR,
+def overwriting_json_data(data: Dict[str, Any] | Iterable[Any] | None = None, file_path: Path = DATA_DIR,
                           file_name: str = DEFAULT_JSON_FILE, metadata: Optional[Dict[str, Any]] = None):
-    """Функция записи/перезаписи json данных в файл"""
-    data_file = file_path / f"{file_name}.json"
-    data_to_save = [data, metadata]
-    with open(data_file, "w", encoding="utf-8") as file:
-        json.dump(data_to_save, file, indent=4, ensure_ascii=False)
-        logger.info(f"Данные сохранены в {data_file}")
+    """Функция записи/перезаписи json данных в файл. data - {"data": [вакансии]} или итерируемый набор вакансий"""
+    vacancies = data.get("data", []) if isinstance(data, dict) else data or []
+    with JsonCacheWriter(file_path, file_name, metadata) as writer:
+        writer.write_many(vacancies)
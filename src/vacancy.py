@@ -0,0 +1,68 @@
+from typing import Any, Dict, Optional
+
+
+class Vacancy:
+    """Компактная запись вакансии: только поля, которые используются при загрузке в БД и обновлении данных.
+    Создаётся из элемента ответа hh.ru сразу при разборе страницы, исходный элемент сохраняется в raw
+    только по запросу (для отладки)"""
+
+    __slots__ = ("id", "employer_id", "name", "salary_from", "salary_to", "currency", "url", "published_at",
+                 "area_id", "raw")
+
+    def __init__(self, id: str, employer_id: Optional[str], name: str, salary_from: Optional[int] = None,
+                 salary_to: Optional[int] = None, currency: Optional[str] = None, url: Optional[str] = None,
+                 published_at: Optional[str] = None, area_id: Optional[str] = None,
+                 raw: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.employer_id = employer_id
+        self.name = name
+        self.salary_from = salary_from
+        self.salary_to = salary_to
+        self.currency = currency
+        self.url = url
+        self.published_at = published_at
+        self.area_id = area_id
+        self.raw = raw
+
+    def __repr__(self):
+        return (f"Vacancy(id={self.id}, employer_id={self.employer_id}, name={self.name!r}, "
+                f"salary={self.salary_from}-{self.salary_to} {self.currency})")
+
+    def __eq__(self, other):
+        if not isinstance(other, Vacancy):
+            return NotImplemented
+        return all(getattr(self, field) == getattr(other, field) for field in self.__slots__)
+
+    @classmethod
+    def from_hh(cls, item: Dict[str, Any], keep_raw: bool = False) -> "Vacancy":
+        """Проекция элемента items из ответа api.hh.ru/vacancies"""
+        salary = item.get("salary") or {}
+        employer = item.get("employer") or {}
+        area = item.get("area") or {}
+        return cls(
+            id=str(item["id"]),
+            employer_id=str(employer["id"]) if employer.get("id") is not None else None,
+            name=item.get("name"),
+            salary_from=salary.get("from"),
+            salary_to=salary.get("to"),
+            currency=salary.get("currency"),
+            url=item.get("alternate_url"),
+            published_at=item.get("published_at"),
+            area_id=str(area["id"]) if area.get("id") is not None else None,
+            raw=item if keep_raw else None,
+        )
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Vacancy":
+        """Восстановление из словаря to_dict. Полные элементы hh.ru (файлы данных прежнего формата)
+        распознаются по полю alternate_url и проецируются"""
+        if "alternate_url" in data:
+            return cls.from_hh(data)
+        return cls(**{field: data.get(field) for field in cls.__slots__})
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Словарь для записи в файл данных, raw включается только если сохранён"""
+        data = {field: getattr(self, field) for field in self.__slots__ if field != "raw"}
+        if self.raw is not None:
+            data["raw"] = self.raw
+        return data